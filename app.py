@@ -1,14 +1,37 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, g, has_app_context
 import os
+import hmac
+import json
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 import random
-from scipy.sparse import load_npz
+import threading
+import time
+from scipy.sparse import csr_matrix, load_npz
+
+from bundle import bundle_exists, check_bundle_tfidf, load_vectorizer, open_bundle
+from cache import ResponseCache
+from catalog import (DEFAULT_MOOD, MOOD_GENRES, RATING_DECIMALS, REGION_NAMES, REGIONS, bits_mask,
+                     catalog_from_dataframe, filter_mask, first_rows, lookup_rows, region_mask)
+from factors import TOP_IDS_FILE, TOP_SCORES_FILE, factor_catalog_rows, load_factor_ids, top_k_scores
+from ingest import append_movies, movies_frame
+from metrics import MetricsRegistry, RequestProfiler
+from rerank import candidate_signals, parse_rerank_options, rerank
+from search import InvertedIndex
+from similarity import BruteForceEngine, normalize_rows
+from tfidf import check_tfidf, read_manifest as read_tfidf_manifest
+
+# orjson is optional; responses fall back to the standard library encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
+POSTER_PLACEHOLDER = '/static/img/no-poster.jpg'
+
 # Helper function to check if file exists and is readable
 def safe_file_exists(file_path):
     """Check if a file exists and is accessible."""
@@ -28,16 +51,30 @@ def load_models():
     models = {}
     
     try:
-        # Define paths to model files using absolute paths
+        # Define paths to model files using absolute paths (MODELS_DIR/DATA_DIR override them,
+        # e.g. to serve a synthetic catalog from `python benchmark.py generate`)
         base_dir = os.path.dirname(__file__)
-        models_dir = os.path.join(base_dir, 'models')
-        data_dir = os.path.join(base_dir, 'data')
+        models_dir = os.environ.get('MODELS_DIR', os.path.join(base_dir, 'models'))
+        data_dir = os.environ.get('DATA_DIR', os.path.join(base_dir, 'data'))
+        
+        # Prefer the prebuilt memory-mapped bundle (`python build.py bundle`), unless the
+        # TF-IDF artifacts were rebuilt after it
+        if bundle_exists(models_dir):
+            try:
+                check_bundle_tfidf(models_dir)
+            except ValueError as e:
+                print(f"Warning: {e}; loading the movie data and model files instead")
+            else:
+                with load_timer('total'):
+                    return load_bundle_models(models_dir)
+        load_started = time.perf_counter()
         
         # Load movie data
         movies_path = os.path.join(data_dir, 'movies2024.csv')
         print(f"Loading movies from: {movies_path}")
         if safe_file_exists(movies_path):
-            movies_df = pd.read_csv(movies_path)
+            with load_timer('movies'):
+                movies_df = pd.read_csv(movies_path)
             models['movies_df'] = movies_df
         else:
             print(f"Warning: Movie data file not found at {movies_path}")
@@ -46,416 +83,1044 @@ def load_models():
         # Load TF-IDF vectorizer
         tfidf_path = os.path.join(models_dir, 'tfidf_vectorizer.pkl')
         if safe_file_exists(tfidf_path):
-            with open(tfidf_path, 'rb') as f:
+            with load_timer('tfidf_vectorizer'), open(tfidf_path, 'rb') as f:
                 models['tfidf'] = pickle.load(f)
         
         # Load user and movie features
         user_features_path = os.path.join(models_dir, 'user_features.npy')
         if safe_file_exists(user_features_path):
-            models['user_features'] = np.load(user_features_path)
+            with load_timer('user_features'):
+                models['user_features'] = np.load(user_features_path, mmap_mode='r')
         
         movie_features_path = os.path.join(models_dir, 'movie_features.npy')
         if safe_file_exists(movie_features_path):
-            models['movie_features'] = np.load(movie_features_path)
+            with load_timer('movie_features'):
+                models['movie_features'] = np.load(movie_features_path, mmap_mode='r')
+                models['movie_feature_ids'] = load_factor_ids(models_dir)
+        
+        # Load the precomputed per-user top-K lists (built by `python build.py personalized`)
+        top_ids_path = os.path.join(models_dir, TOP_IDS_FILE)
+        top_scores_path = os.path.join(models_dir, TOP_SCORES_FILE)
+        if safe_file_exists(top_ids_path) and safe_file_exists(top_scores_path):
+            models['personalized_ids'] = np.load(top_ids_path, mmap_mode='r')
+            models['personalized_scores'] = np.load(top_scores_path, mmap_mode='r')
         
-        # Load the sparse TF-IDF matrix
+        # Load the sparse TF-IDF matrix, kept only as float32 L2-normalized rows (as in a bundle)
         tfidf_matrix_path = os.path.join(models_dir, 'tfidf_matrix.npz')
         if safe_file_exists(tfidf_matrix_path):
-            models['tfidf_matrix'] = load_npz(tfidf_matrix_path)
+            with load_timer('tfidf_matrix'):
+                tfidf_matrix = load_tfidf_matrix(models_dir, tfidf_matrix_path, movies_df, models)
+            if tfidf_matrix is not None:
+                models['tfidf_matrix'] = tfidf_matrix
         
-        # Load the sample similarity matrix and indices
-        cosine_sim_path = os.path.join(models_dir, 'cosine_sim_sample.npy')
-        if safe_file_exists(cosine_sim_path):
-            models['cosine_sim_sample'] = np.load(cosine_sim_path)
+        if 'tfidf_matrix' in models:
+            # Exact similarity search over the normalized rows
+            models['similarity_engine'] = BruteForceEngine(models['tfidf_matrix'])
+            
+            # Inverted index for free-text search
+            with load_timer('search_index'):
+                models['search_index'] = InvertedIndex.from_matrix(models['similarity_engine'].vectors)
         
-        sample_indices_path = os.path.join(models_dir, 'sample_indices.npy')
-        if safe_file_exists(sample_indices_path):
-            models['sample_indices'] = np.load(sample_indices_path)
+        # Load the precomputed top-K neighbor table (built by `python build.py neighbors`)
+        neighbor_ids_path = os.path.join(models_dir, 'neighbor_ids.npy')
+        neighbor_scores_path = os.path.join(models_dir, 'neighbor_scores.npy')
+        if safe_file_exists(neighbor_ids_path) and safe_file_exists(neighbor_scores_path):
+            with load_timer('neighbor_table'):
+                models['neighbor_ids'] = np.load(neighbor_ids_path, mmap_mode='r')
+                models['neighbor_scores'] = np.load(neighbor_scores_path, mmap_mode='r')
+            check_neighbor_table(models)
         
         # Load genre encoder
         genre_mlb_path = os.path.join(models_dir, 'genre_mlb.pkl')
         if safe_file_exists(genre_mlb_path):
-            with open(genre_mlb_path, 'rb') as f:
+            with load_timer('genre_mlb'), open(genre_mlb_path, 'rb') as f:
                 models['genre_mlb'] = pickle.load(f)
         
+        with load_timer('catalog'):
+            prepare_catalog(models)
+            prepare_factors(models)
+        model_load_seconds.labels(artifact='total').set(time.perf_counter() - load_started)
+        
         print("Models loaded successfully!")
         return models
     except Exception as e:
         print(f"Error loading models: {e}")
         # For demonstration, return empty dict with just movies_df if available
         try:
-            movies_path = os.path.join(os.path.dirname(__file__), 'data', 'movies2024.csv')
+            movies_path = os.path.join(os.environ.get('DATA_DIR', os.path.join(os.path.dirname(__file__), 'data')),
+                                       'movies2024.csv')
             if safe_file_exists(movies_path):
-                movies_df = pd.read_csv(movies_path)
-                return {'movies_df': movies_df}
+                fallback_models = {'movies_df': pd.read_csv(movies_path)}
+                prepare_catalog(fallback_models)
+                return fallback_models
         except Exception as e:
             print(f"Error loading movie data: {e}")
         return {}
 
-# Global variable to store models
-models = load_models()
+# Load the TF-IDF matrix, checked against the manifest of `python build.py tfidf` when there is one
+def load_tfidf_matrix(models_dir, tfidf_matrix_path, movies_df, models):
+    tfidf_matrix = load_npz(tfidf_matrix_path)
+    manifest = read_tfidf_manifest(models_dir)
+    if manifest is None:
+        return normalize_rows(tfidf_matrix, dtype=np.float32)
+    try:
+        check_tfidf(manifest, tfidf_matrix, movies_df['MovieID'].to_numpy(dtype=np.int64),
+                    os.path.join(models_dir, 'tfidf_vectorizer.pkl') if 'tfidf' in models else None)
+    except ValueError as e:
+        print(f"Warning: {e}; content recommendations are off until `python build.py tfidf` is rerun")
+        models.pop('tfidf', None)
+        return None
+    # Rows were L2-normalized by the build
+    return tfidf_matrix.astype(np.float32)
 
-# Helper function to classify movie region
-def classify_movie_region(movie_row):
-    """
-    Classify movies into regional cinema categories based on available information
-    """
-    title = str(movie_row['Title']).lower()
-    actors = str(movie_row['Actors']).lower() if 'Actors' in movie_row else ""
-    directors = str(movie_row['Directors']).lower() if 'Directors' in movie_row else ""
-    overview = str(movie_row['Overview']).lower() if 'Overview' in movie_row else ""
-    
-    # Combined text for analysis
-    combined_text = f"{title} {actors} {directors} {overview}"
-    
-    # Define keywords/patterns for different regional cinemas
-    bollywood_patterns = ['bollywood', 'hindi', 'india', 'indian', 'mumbai', 'khan', 'kapoor', 'chopra', 'johar', 'bhatt']
-    tollywood_patterns = ['telugu', 'tollywood', 'hyderabad', 'andhra', 'telangana', 'rajamouli', 'prabhas', 'allu', 'chiranjeevi']
-    kollywood_patterns = ['tamil', 'kollywood', 'chennai', 'rajinikanth', 'vijay', 'ajith']
-    
-    # Check for regional cinema markers
-    for pattern in bollywood_patterns:
-        if pattern in combined_text:
-            return "Bollywood"
-            
-    for pattern in tollywood_patterns:
-        if pattern in combined_text:
-            return "Tollywood"
-            
-    for pattern in kollywood_patterns:
-        if pattern in combined_text:
-            return "Kollywood"
-            
-    # Default to Hollywood (Western cinema) if no other patterns match
-    return "Hollywood"
+# Drop a neighbor table built for another TF-IDF matrix (rebuilt since by `python build.py tfidf`)
+def check_neighbor_table(models):
+    if 'neighbor_ids' not in models or 'tfidf_matrix' not in models:
+        return
+    if len(models['neighbor_ids']) != models['tfidf_matrix'].shape[0]:
+        print(f"Warning: the neighbor table has {len(models['neighbor_ids'])} rows, not "
+              f"{models['tfidf_matrix'].shape[0]}; ignored until `python build.py neighbors` is rerun")
+        models.pop('neighbor_ids')
+        models.pop('neighbor_scores', None)
 
-# Apply regional classification if not present
-def prepare_movies_df():
-    global models
-    movies_df = models.get('movies_df')
-    
-    if movies_df is None:
-        return None
-    
-    # Add region classification if needed
-    if 'Region' not in movies_df.columns:
-        print("Classifying movies by regional cinema...")
-        movies_df['Region'] = movies_df.apply(classify_movie_region, axis=1)
-    
-    return movies_df
+# Build the columnar catalog and ranked orderings at load time; the DataFrame
+# is dropped afterwards, since the catalog holds everything requests read
+def prepare_catalog(models):
+    movies_df = models.pop('movies_df', None)
+    if movies_df is not None:
+        models['catalog'] = catalog_from_dataframe(movies_df, models.get('genre_mlb'))
 
-# API endpoint to get recommendations
-@app.route('/api/recommendations', methods=['POST'])
-def get_recommendations():
-    user_preferences = request.json
-    print("Received user preferences:", user_preferences)
+# Tie movie factor rows to catalog rows for the personalized mode
+def prepare_factors(models):
+    if 'catalog' in models and 'movie_features' in models and 'user_features' in models:
+        try:
+            factor_rows = factor_catalog_rows(
+                models['catalog'], len(models['movie_features']), models.get('movie_feature_ids'))
+        except ValueError as e:
+            # Nothing factor-related is kept, so every user is unknown and personalized
+            # requests get basic recommendations
+            print(f"Personalized recommendations disabled: {e}")
+            models.pop('movie_factors', None)
+            return
+        if 'movie_factors' not in models:
+            # Bundles carry a float32 copy, shared between workers instead of converted by each
+            models['movie_factors'] = np.ascontiguousarray(models['movie_features'], dtype=np.float32)
+        models['factor_rows'] = factor_rows.astype(np.int32)
+        in_catalog = models['factor_rows'] >= 0
+        models['catalog_factor_rows'] = np.full(models['catalog']['size'], -1, dtype=np.int32)
+        models['catalog_factor_rows'][models['factor_rows'][in_catalog]] = np.flatnonzero(in_catalog)
+
+# Load models from the memory-mapped bundle; pages are shared between workers
+def load_bundle_models(models_dir):
+    with load_timer('bundle'):
+        bundle = open_bundle(models_dir)
+    manifest = bundle.pop('manifest')
+    print(f"Opened model bundle version {manifest['version']} ({manifest['size']} movies)")
     
-    movies_df = prepare_movies_df()
-    if movies_df is None:
-        return jsonify({'error': 'Movie data not available'}), 500
+    models = {key: value for key, value in bundle.items()
+              if key not in ('tfidf_vocabulary', 'tfidf_idf') and not key.startswith('postings_')}
+    if 'tfidf_vocabulary' in bundle:
+        with load_timer('tfidf_vectorizer'):
+            models['tfidf'] = load_vectorizer(dict(bundle, manifest=manifest))
+    if 'postings_offsets' in bundle:
+        models['search_index'] = InvertedIndex.from_arrays(bundle)
+    if 'tfidf_matrix' in models:
+        # Bundled rows are already L2-normalized
+        models['similarity_engine'] = BruteForceEngine(models['tfidf_matrix'])
+    check_neighbor_table(models)
+    with load_timer('catalog'):
+        prepare_factors(models)
     
-    # Extract user preferences
-    recommendation_type = user_preferences.get('recommendationType', '')
-    sub_type = user_preferences.get('subType', '')
+    print("Models loaded successfully!")
+    return models
+
+# Pipeline metrics, served on /metrics (METRICS_ENABLED=0 turns recording off)
+metrics = MetricsRegistry(enabled=os.environ.get('METRICS_ENABLED', '1') != '0')
+request_seconds = metrics.histogram(
+    'movie_matchmaker_request_seconds', 'Request latency by endpoint.', ('endpoint',))
+requests_total = metrics.counter(
+    'movie_matchmaker_requests', 'Requests by endpoint and status code.', ('endpoint', 'status'))
+stage_seconds = metrics.histogram(
+    'movie_matchmaker_stage_seconds', 'Time spent in each stage of the recommendation pipeline.', ('stage',))
+filter_seconds = metrics.histogram(
+    'movie_matchmaker_filter_seconds', 'Time spent applying each request filter.', ('filter',))
+mode_seconds = metrics.histogram(
+    'movie_matchmaker_mode_seconds', 'Time spent generating recommendations, by mode.', ('type', 'sub_type'))
+fallbacks_total = metrics.counter(
+    'movie_matchmaker_basic_fallbacks', 'Requests answered by basic recommendations after their mode failed.',
+    ('mode',))
+model_load_seconds = metrics.gauge(
+    'movie_matchmaker_model_load_seconds', 'Duration of each model loading step at startup.', ('artifact',))
+
+# Series used on every request are resolved once
+STAGES = {stage: stage_seconds.labels(stage=stage)
+          for stage in ('parse', 'cache', 'filter', 'recommend', 'format', 'encode', 'rerank', 'search', 'ingest')}
+FILTERS = {name: filter_seconds.labels(filter=name) for name in ('time_period', 'rating', 'popularity', 'genre')}
+
+# Mode labels are limited to known values so user input cannot create new series
+KNOWN_SUB_TYPES = {
+    'mood': set(MOOD_GENRES),
+    'discovery': {'hidden', 'underrated', 'cult', 'awards'},
+    'regional': set(REGIONS),
+}
+KNOWN_TYPES = {'content', 'personalized'} | set(KNOWN_SUB_TYPES)
+
+# Opt-in profiling of slow requests (PROFILE_SAMPLE_RATE > 0)
+request_profiler = RequestProfiler(
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    threshold_ms=float(os.environ.get('PROFILE_SLOW_MS', 250)),
+    output_dir=os.environ.get('PROFILE_DIR'))
+
+# Helper function to time one step of load_models
+def load_timer(artifact):
+    return model_load_seconds.labels(artifact=artifact).time()
+
+# Helper function to record how long one request filter took
+def observe_filter(name, seconds):
+    FILTERS[name].observe(seconds)
+
+# Helper function to count a mode falling back to basic recommendations
+def count_fallback(mode):
+    fallbacks_total.labels(mode=mode).inc()
+    if has_app_context():
+        # Read by get_recommendation_body, which never caches a fallback answer
+        g.fell_back = True
+
+# Global variable to store models
+models = load_models()
+
+# Ingestion swaps in a new snapshot; each request keeps the one it started with
+ingest_lock = threading.Lock()
+
+# Helper function to get the models snapshot pinned to the current request (or app context)
+def current_models():
+    if has_app_context():
+        if 'models' not in g:
+            g.models = models
+        return g.models
+    return models
+
+# Responses of the deterministic recommendation modes, keyed by normalized preferences
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.environ.get('RECOMMENDATION_CACHE_TTL', 300)))
+
+# Cache counters are exported at scrape time
+def cache_metrics():
+    stats = response_cache.stats()
+    lines = []
+    for name, kind, value in (('entries', 'gauge', stats['entries']), ('hits', 'counter', stats['hits']),
+                              ('misses', 'counter', stats['misses']), ('evictions', 'counter', stats['evictions']),
+                              ('expirations', 'counter', stats['expirations'])):
+        metric = f"movie_matchmaker_cache_{name}"
+        suffix = '_total' if kind == 'counter' else ''
+        lines += [f"# HELP {metric} Recommendation response cache {name}.", f"# TYPE {metric} {kind}",
+                  f"{metric}{suffix} {value}"]
+    return lines
+
+metrics.collectors.append(cache_metrics)
+
+# Content recommendations pick a random reference movie, so they are never cached
+UNCACHED_TYPES = {'content'}
+
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 256))
+
+MAX_SEEDS = int(os.environ.get('MAX_SEEDS', 100))
+
+MAX_SEARCH_RESULTS = 50
+
+MAX_INGEST_SIZE = int(os.environ.get('MAX_INGEST_SIZE', 1000))
+
+# Candidates generated per request before the hybrid re-ranker picks the final few
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 200))
+
+# How the vectors of several seed movies are combined into one query
+SEED_AGGREGATIONS = ('mean', 'max')
+
+# Helper function to extract user preferences from a request payload (ValueError on too many seeds)
+def parse_preferences(user_preferences):
     genres = user_preferences.get('genre', [])
     if isinstance(genres, str):
         genres = [genres]
-    time_period = user_preferences.get('timePeriod', 'any')
-    rating_preference = user_preferences.get('rating', 'any-rating')
-    popularity_preference = user_preferences.get('popularity', 'any')
-    
-    # Pre-filter movies based on common criteria
-    filtered_movies = movies_df.copy()
-    
-    # Apply time period filter
-    if time_period == 'classic':
-        filtered_movies = filtered_movies[filtered_movies['ReleaseYear'] < 2000]
-    elif time_period == 'modern':
-        filtered_movies = filtered_movies[(filtered_movies['ReleaseYear'] >= 2000) & 
-                                         (filtered_movies['ReleaseYear'] < 2020)]
-    elif time_period == 'recent':
-        filtered_movies = filtered_movies[filtered_movies['ReleaseYear'] >= 2020]
-    
-    # Apply rating filter
-    if rating_preference == 'high-rated':
-        filtered_movies = filtered_movies[filtered_movies['VoteAverage'] >= 7.0]
-    
-    # Apply popularity filter
-    if popularity_preference == 'popular':
-        filtered_movies = filtered_movies[filtered_movies['Popularity'] > 30]
-    elif popularity_preference == 'lesser-known':
-        filtered_movies = filtered_movies[filtered_movies['Popularity'] <= 30]
-    
-    # Apply genre filter if it's not 'any'
-    if genres and 'any' not in genres:
-        # Create a filter for movies containing any of the selected genres
-        genre_filter = filtered_movies['Genres'].str.contains('|'.join(genres), na=False)
-        filtered_movies = filtered_movies[genre_filter]
+    seed_movie_ids = user_preferences.get('seedMovieIds', [])
+    if not isinstance(seed_movie_ids, list):
+        seed_movie_ids = [seed_movie_ids]
+    if len(seed_movie_ids) > MAX_SEEDS:
+        raise ValueError(f'At most {MAX_SEEDS} seedMovieIds are allowed')
+    seed_movie_ids = [movie_id for movie_id in seed_movie_ids
+                      if isinstance(movie_id, int) and not isinstance(movie_id, bool)]
+    user_id = user_preferences.get('userId')
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        user_id = None
+    seed_aggregation = user_preferences.get('seedAggregation', 'mean')
+    if seed_aggregation not in SEED_AGGREGATIONS:
+        seed_aggregation = 'mean'
+    # Strings throughout, so set and dict lookups on them cannot fail on lists or objects
+    return {
+        'recommendation_type': str(user_preferences.get('recommendationType', '')),
+        'sub_type': str(user_preferences.get('subType', '')),
+        'genres': [str(genre) for genre in genres] if isinstance(genres, list) else [],
+        'time_period': str(user_preferences.get('timePeriod', 'any')),
+        'rating': str(user_preferences.get('rating', 'any-rating')),
+        'popularity': str(user_preferences.get('popularity', 'any')),
+        'seed_movie_ids': seed_movie_ids,
+        'seed_aggregation': seed_aggregation,
+        'user_id': user_id,
+        'rerank': parse_rerank_options(user_preferences.get('rerank')),
+    }
+
+# Helper function to build the key of the filters shared by all recommendation types
+def filter_key(preferences):
+    genres = preferences['genres']
+    if not genres or 'any' in genres:
+        genres = ()
+    return (str(preferences['time_period']), str(preferences['rating']), str(preferences['popularity']),
+            tuple(sorted(set(map(str, genres)))))
+
+# Helper function to build the cache key for a set of preferences (None if not cacheable)
+def cache_key(preferences):
+    if preferences['seed_movie_ids']:
+        seeds = (preferences['seed_aggregation'],) + tuple(sorted(set(preferences['seed_movie_ids'])))
+        key = ('seeds',) + seeds + filter_key(preferences)
+    elif preferences['recommendation_type'] in UNCACHED_TYPES:
+        return None
+    elif preferences['recommendation_type'] == 'personalized':
+        key = ('personalized', preferences['user_id']) + filter_key(preferences)
+    else:
+        key = (str(preferences['recommendation_type']), str(preferences['sub_type'])) + filter_key(preferences)
+    if preferences['rerank'] is not None:
+        # Re-ranked lists also depend on the weights, and on the user through the factor signal
+        key += ('rerank', preferences['user_id']) + tuple(sorted(preferences['rerank'].items()))
+    return key
+
+# Pre-filter movies based on common criteria, as one mask over the catalog
+def get_candidate_mask(preferences):
+    models = current_models()
+    return filter_mask(models['catalog'], preferences['time_period'], preferences['rating'],
+                       preferences['popularity'], preferences['genres'], observe=observe_filter)
+
+# Helper function to produce the JSON body for one set of preferences
+def get_recommendation_body(preferences, candidate_mask_for=get_candidate_mask):
+    models = current_models()
+    # Deterministic modes are served from the response cache when possible
+    key = cache_key(preferences)
+    if key is not None:
+        # Bodies computed from an older snapshot are never served after an ingest
+        key = (models.get('generation', 0),) + key
+        with STAGES['cache'].time():
+            cached_body = response_cache.get(key)
+        if cached_body is not None:
+            return cached_body
+    
+    with STAGES['filter'].time():
+        candidate_mask = candidate_mask_for(preferences)
+    recommendation_type = preferences['recommendation_type']
+    sub_type = preferences['sub_type']
+    seed_rows = lookup_rows(models['catalog'], preferences['seed_movie_ids'])
+    if preferences['seed_movie_ids'] and len(seed_rows) == 0:
+        # None of the seeds are in the catalog; answer like a request without seeds
+        key = None if recommendation_type in UNCACHED_TYPES else key
     
     # Handle each recommendation type
     recommendations = []
+    started = time.perf_counter()
+    if has_app_context():
+        g.fell_back = False
     
     try:
-        if recommendation_type == 'content':
-            recommendations = get_content_based_recommendations(filtered_movies, sub_type)
+        if preferences['rerank'] is not None:
+            # Candidates from the requested mode, re-ranked on blended signals
+            recommendations = get_reranked_recommendations(preferences, candidate_mask, seed_rows)
+        elif len(seed_rows):
+            # Content recommendations for the movies the user picked
+            recommendations = get_seeded_recommendations(
+                [seed_rows], [candidate_mask], preferences['seed_aggregation'])[0]
+        elif recommendation_type == 'content':
+            recommendations = get_content_based_recommendations(candidate_mask, sub_type)
+        elif recommendation_type == 'personalized':
+            recommendations = get_personalized_recommendations([preferences['user_id']], [candidate_mask])[0]
         elif recommendation_type == 'mood':
-            recommendations = get_mood_based_recommendations(filtered_movies, sub_type)
+            recommendations = get_mood_based_recommendations(candidate_mask, sub_type)
         elif recommendation_type == 'discovery':
-            recommendations = get_discovery_recommendations(filtered_movies, sub_type)
+            recommendations = get_discovery_recommendations(candidate_mask, sub_type)
         elif recommendation_type == 'regional':
-            recommendations = get_regional_recommendations(filtered_movies, sub_type)
+            recommendations = get_regional_recommendations(candidate_mask, sub_type)
         else:
             # Fallback to basic recommendations
-            recommendations = get_basic_recommendations(filtered_movies)
+            recommendations = get_basic_recommendations(candidate_mask)
     except Exception as e:
         print(f"Error generating recommendations: {e}")
-        recommendations = get_basic_recommendations(filtered_movies)
+        count_fallback(mode_labels(preferences)[0])
+        recommendations = get_basic_recommendations(candidate_mask)
+        key = None
+    if has_app_context() and g.fell_back:
+        # Basic recommendations stood in for a failed mode; the next request retries the mode
+        key = None
+    elapsed = time.perf_counter() - started
+    STAGES['recommend'].observe(elapsed)
+    mode_type, mode_sub_type = mode_labels(preferences)
+    mode_seconds.labels(type=mode_type, sub_type=mode_sub_type).observe(elapsed)
     
-    return jsonify(recommendations)
+    with STAGES['encode'].time():
+        body = encode_json(recommendations)
+    if key is not None:
+        response_cache.put(key, body)
+    return body
 
-# Content-based recommendations
-def get_content_based_recommendations(filtered_movies, sub_type, num_recommendations=6):
+# Helper function to label a request's mode for metrics (bounded to known values)
+def mode_labels(preferences):
+    if preferences['seed_movie_ids']:
+        return 'seeds', ''
+    recommendation_type = preferences['recommendation_type']
+    if recommendation_type not in KNOWN_TYPES:
+        return 'basic', ''
+    sub_type = preferences['sub_type']
+    return recommendation_type, sub_type if sub_type in KNOWN_SUB_TYPES.get(recommendation_type, ()) else ''
+
+# API endpoint to get recommendations
+@app.route('/api/recommendations', methods=['POST'])
+def get_recommendations():
+    models = current_models()
+    started = time.perf_counter()
+    user_preferences = request.json
+    parse_seconds = time.perf_counter() - started
+    print("Received user preferences:", user_preferences)
+    
+    if 'catalog' not in models:
+        return jsonify({'error': 'Movie data not available'}), 500
+    
+    started = time.perf_counter()
+    try:
+        preferences = parse_preferences(user_preferences)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    STAGES['parse'].observe(parse_seconds + time.perf_counter() - started)
+    body = get_recommendation_body(preferences)
+    return app.response_class(body, mimetype='application/json')
+
+# API endpoint to get recommendations for many preference sets at once
+@app.route('/api/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    """
+    Accepts a JSON list of preference objects (or {"requests": [...]}) and
+    returns a list with one recommendation list per entry, in order.
+
+    Entries with `seedMovieIds` get content recommendations scored together
+    in one sparse matrix product per seed aggregation, and personalized
+    entries in one factor matrix product; entries sharing the same filters share one
+    candidate mask, and identical deterministic entries are computed once.
+    """
+    models = current_models()
+    payload = request.json
+    if isinstance(payload, dict):
+        payload = payload.get('requests')
+    if not isinstance(payload, list) or not all(isinstance(item, dict) for item in payload):
+        return jsonify({'error': 'Expected a list of preference objects'}), 400
+    if len(payload) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch size is limited to {MAX_BATCH_SIZE}'}), 400
+    print(f"Received batch of {len(payload)} preference sets")
+    
+    if 'catalog' not in models:
+        return jsonify({'error': 'Movie data not available'}), 500
+    
+    try:
+        all_preferences = [parse_preferences(item) for item in payload]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Candidate masks are computed once per distinct filter tuple
+    masks = {}
+    def candidate_mask_for(preferences):
+        key = filter_key(preferences)
+        if key not in masks:
+            masks[key] = get_candidate_mask(preferences)
+        return masks[key]
+    
+    bodies = [None] * len(all_preferences)
+    
+    # Score the seeded entries together, one group per seed aggregation
+    seeded = {aggregation: [] for aggregation in SEED_AGGREGATIONS}
+    for i, preferences in enumerate(all_preferences):
+        seed_rows = lookup_rows(models['catalog'], preferences['seed_movie_ids'])
+        if len(seed_rows) and preferences['rerank'] is None:
+            seeded[preferences['seed_aggregation']].append((i, seed_rows))
+    for aggregation, entries in seeded.items():
+        if not entries:
+            continue
+        try:
+            seeded_results = get_seeded_recommendations(
+                [seed_rows for _, seed_rows in entries],
+                [candidate_mask_for(all_preferences[i]) for i, _ in entries],
+                aggregation)
+        except Exception as e:
+            # Left to the per-entry path below, which falls back to basic recommendations
+            print(f"Error generating seeded batch recommendations: {e}")
+            continue
+        for (i, _), recommendations in zip(entries, seeded_results):
+            bodies[i] = encode_json(recommendations)
+    
+    # Score the personalized entries together as well
+    personalized = [i for i, preferences in enumerate(all_preferences)
+                    if bodies[i] is None and preferences['recommendation_type'] == 'personalized'
+                    and preferences['rerank'] is None and is_known_user(preferences['user_id'])]
+    if personalized:
+        try:
+            personalized_results = get_personalized_recommendations(
+                [all_preferences[i]['user_id'] for i in personalized],
+                [candidate_mask_for(all_preferences[i]) for i in personalized])
+        except Exception as e:
+            print(f"Error generating personalized batch recommendations: {e}")
+            personalized_results = [None] * len(personalized)
+        for i, recommendations in zip(personalized, personalized_results):
+            if recommendations is not None:
+                bodies[i] = encode_json(recommendations)
+    
+    for i, preferences in enumerate(all_preferences):
+        if bodies[i] is None:
+            bodies[i] = get_recommendation_body(preferences, candidate_mask_for)
+    
+    return app.response_class(b'[' + b','.join(bodies) + b']', mimetype='application/json')
+
+# API endpoint for free-text search
+@app.route('/api/search', methods=['POST'])
+def search_movies():
+    """
+    Match free text (e.g. "slow-burn heist in Mumbai") against the catalog.
+
+    The text is transformed with the fitted TF-IDF vectorizer and scored
+    through the inverted index; the same filters as /api/recommendations
+    (genre, timePeriod, rating, popularity) are applied to posting lists
+    while they are traversed.
+    """
+    models = current_models()
+    payload = request.json or {}
+    query = payload.get('query', '')
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({'error': 'Expected a non-empty query string'}), 400
+    print("Received search query:", query)
+    
+    if 'catalog' not in models or 'tfidf' not in models or 'search_index' not in models:
+        return jsonify({'error': 'Search is not available'}), 500
+    
+    try:
+        limit = min(max(int(payload.get('limit', 6)), 1), MAX_SEARCH_RESULTS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    try:
+        preferences = parse_preferences(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    catalog = models['catalog']
+    def accept(rows):
+        return filter_mask(catalog, preferences['time_period'], preferences['rating'],
+                           preferences['popularity'], preferences['genres'], rows=rows)
+    
+    with STAGES['search'].time():
+        query_vector = models['tfidf'].transform([query])
+        rows, _ = models['search_index'].search(query_vector, k=limit, accept=accept)
+    
+    return app.response_class(encode_json(format_recommendations(rows)), mimetype='application/json')
+
+# API endpoint to add new movies to the running catalog
+@app.route('/api/movies', methods=['POST'])
+def ingest_movies():
+    """
+    Append new releases to the in-memory catalog without a reload.
+
+    Accepts a JSON list of movie objects keyed like the CSV columns (or
+    {"movies": [...]}). Disabled unless INGEST_TOKEN is set; the token must
+    be sent as `Authorization: Bearer <token>`. Each gunicorn worker holds
+    its own snapshot, so only the worker serving this request is updated.
+    """
     global models
+    token = os.environ.get('INGEST_TOKEN')
+    if not token:
+        return jsonify({'error': 'Ingestion is disabled'}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                               f"Bearer {token}".encode('utf-8')):
+        return jsonify({'error': 'Unauthorized'}), 401
     
+    payload = request.json
+    if isinstance(payload, dict):
+        payload = payload.get('movies')
+    if isinstance(payload, list) and len(payload) > MAX_INGEST_SIZE:
+        return jsonify({'error': f'At most {MAX_INGEST_SIZE} movies can be added at once'}), 400
     try:
-        # Use the sample similarity matrix if available
-        if 'cosine_sim_sample' in models and 'sample_indices' in models:
-            # Get a random movie as reference
-            # In a real app, we'd use a movie selected by the user
-            if len(filtered_movies) == 0:
-                return []
-                
-            reference_idx = random.randint(0, len(filtered_movies) - 1)
-            reference_movie_id = filtered_movies.iloc[reference_idx]['MovieID']
-            
-            # Find this movie in the sample indices
-            sample_indices = models['sample_indices']
-            cosine_sim_sample = models['cosine_sim_sample']
-            
-            # Check if this movie is in the sample indices
-            if reference_movie_id in sample_indices:
-                sample_idx = np.where(sample_indices == reference_movie_id)[0][0]
-                
-                # Get similarity scores for this movie
-                sim_scores = list(enumerate(cosine_sim_sample[sample_idx]))
-                sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-                
-                # Get top similar movie indices (excluding the reference movie)
-                top_indices = [sample_indices[i[0]] for i in sim_scores if i[0] != sample_idx][:20]
-                
-                # Get top similar movies
-                top_movies = models['movies_df'][models['movies_df']['MovieID'].isin(top_indices)]
-                
-                # Filter based on previously applied criteria
-                top_movies = top_movies[top_movies['MovieID'].isin(filtered_movies['MovieID'])]
-                
-                # Take top N recommendations
-                top_recommendations = top_movies.head(num_recommendations)
-                
-                # Format recommendations for frontend
-                recommendations = format_recommendations(top_recommendations)
-                
-                return recommendations
-            
-        # If we can't use the sample similarity matrix, compute similarities on demand
-        if 'tfidf_matrix' in models:
-            if len(filtered_movies) == 0:
+        movies_df = movies_frame(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if 'catalog' not in models:
+        return jsonify({'error': 'Movie data not available'}), 500
+    
+    # One writer at a time; readers never wait, they keep their pinned snapshot
+    with ingest_lock:
+        try:
+            with STAGES['ingest'].time():
+                snapshot, added_ids, skipped_ids = append_movies(models, movies_df)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if added_ids:
+            snapshot['generation'] = models.get('generation', 0) + 1
+            models = snapshot
+            response_cache.clear()
+    print(f"Ingested {len(added_ids)} movies ({len(skipped_ids)} skipped)")
+    
+    return jsonify({'added': added_ids, 'skipped': skipped_ids, 'size': snapshot['catalog']['size']})
+
+# Helper function to summarize a pipeline stage from its latency histogram
+def stage_stats(stage):
+    calls, total, p50, p99 = STAGES[stage].summary()
+    stats = {'calls': calls, 'totalMs': round(total * 1000, 3)}
+    if calls:
+        stats.update({'p50Ms': round(p50 * 1000, 3), 'p99Ms': round(p99 * 1000, 3)})
+    return stats
+
+# API endpoint to inspect cache counters and re-rank latency
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify({'cache': response_cache.stats(), 'rerank': stage_stats('rerank')})
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Time every request (in the WSGI environ, which is cheaper than flask.g), and profile the sampled ones
+REQUEST_STARTED_KEY = 'movie_matchmaker.request_started'
+
+def time_requests(wsgi_app):
+    def timed_wsgi_app(environ, start_response):
+        environ[REQUEST_STARTED_KEY] = time.perf_counter()
+        profiler = request_profiler.start()
+        if profiler is None:
+            return wsgi_app(environ, start_response)
+        try:
+            return wsgi_app(environ, start_response)
+        finally:
+            elapsed_ms = (time.perf_counter() - environ[REQUEST_STARTED_KEY]) * 1000
+            request_profiler.finish(profiler, elapsed_ms, f"{environ['REQUEST_METHOD']} {environ['PATH_INFO']}")
+    return timed_wsgi_app
+
+app.wsgi_app = time_requests(app.wsgi_app)
+
+@app.after_request
+def record_request_metrics(response):
+    current_request = request._get_current_object()
+    started = current_request.environ.get(REQUEST_STARTED_KEY)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    rule = current_request.url_rule
+    endpoint = rule.rule if rule is not None else 'unmatched'
+    request_seconds.labels(endpoint=endpoint).observe(elapsed)
+    requests_total.labels(endpoint=endpoint, status=response.status_code).inc()
+    return response
+
+# Helper function to find the most similar movies to a catalog row
+def get_similar_movie_rows(row, k=20):
+    """
+    Return up to k catalog row positions most similar to `row`, best first.
+
+    Served in O(K) from the precomputed neighbor table when the row is
+    covered; otherwise searched on demand with the similarity engine
+    (exact or approximate, depending on which index was built offline).
+    """
+    models = current_models()
+    
+    neighbor_ids = models.get('neighbor_ids')
+    if neighbor_ids is not None and row < len(neighbor_ids):
+        similar_rows = neighbor_ids[row]
+        return similar_rows[similar_rows >= 0][:k]
+    
+    similar_rows, _ = models['similarity_engine'].search_row(row, k=k)
+    return similar_rows
+
+# Content-based recommendations
+def get_content_based_recommendations(candidate_mask, sub_type, num_recommendations=6):
+    models = current_models()
+    
+    try:
+        if 'similarity_engine' in models or 'neighbor_ids' in models:
+            candidates = np.flatnonzero(candidate_mask)
+            if len(candidates) == 0:
                 return []
                 
             # Select a random movie as reference
-            reference_idx = random.randint(0, len(filtered_movies) - 1)
-            reference_movie = filtered_movies.iloc[reference_idx]
-            
-            # Get the corresponding index in the original dataset
-            reference_id = reference_movie['MovieID']
-            original_idx = models['movies_df'][models['movies_df']['MovieID'] == reference_id].index
-            
-            if len(original_idx) == 0:
-                return get_basic_recommendations(filtered_movies)
-                
-            original_idx = original_idx[0]
-            
-            # Use TF-IDF similarity
-            movie_vec = models['tfidf_matrix'][original_idx:original_idx+1]
-            
-            # Calculate similarity with all other movies
-            sims = cosine_similarity(movie_vec, models['tfidf_matrix']).flatten()
-            
-            # Get indices of top similar movies
-            sim_indices = sims.argsort()[::-1][1:21]  # Top 20 most similar, excluding self
+            # In a real app, we'd use a movie selected by the user
+            reference_row = candidates[random.randint(0, len(candidates) - 1)]
             
-            # Get original MovieIDs for these indices
-            sim_movies = models['movies_df'].iloc[sim_indices]
+            # Get the most similar movies (excluding the reference movie)
+            similar_rows = get_similar_movie_rows(reference_row, k=20)
             
             # Filter based on previously applied criteria
-            sim_movies = sim_movies[sim_movies['MovieID'].isin(filtered_movies['MovieID'])]
-            
-            # Take top N recommendations
-            top_recommendations = sim_movies.head(num_recommendations)
+            similar_rows = similar_rows[candidate_mask[similar_rows]]
             
-            # Format recommendations for frontend
-            recommendations = format_recommendations(top_recommendations)
-            
-            return recommendations
+            # Format the top N recommendations for frontend
+            return format_recommendations(similar_rows[:num_recommendations])
         
         # Fallback to basic recommendations if needed
-        return get_basic_recommendations(filtered_movies)
+        count_fallback('content')
+        return get_basic_recommendations(candidate_mask)
         
     except Exception as e:
         print(f"Error in content-based recommendations: {e}")
-        return get_basic_recommendations(filtered_movies)
+        count_fallback('content')
+        return get_basic_recommendations(candidate_mask)
 
-# Mood-based recommendations
-def get_mood_based_recommendations(filtered_movies, mood, num_recommendations=6):
-    # Map moods to genres
-    mood_genres = {
-        'happy': ['Comedy', 'Animation', 'Family', 'Adventure'],
-        'sad': ['Drama', 'Romance', 'Music'],
-        'excited': ['Action', 'Adventure', 'Science Fiction', 'Fantasy'],
-        'relaxed': ['Documentary', 'History', 'TV Movie'],
-        'thoughtful': ['Drama', 'History', 'Documentary', 'War'],
-        'romantic': ['Romance', 'Comedy', 'Drama']
-    }
+# Content-based recommendations for one or more seed lists, scored together
+def get_seeded_recommendations(seed_row_lists, candidate_masks, aggregation='mean',
+                               num_recommendations=6, memory_budget=64 * 2**20):
+    """Recommend movies similar to each entry's seed movies (e.g. a watched list)."""
+    return [format_recommendations(rows) for rows, _ in score_seeded_rows(
+        seed_row_lists, candidate_masks, aggregation, num_recommendations, memory_budget)]
+
+# Helper function to split seed lists into chunks whose similarity slab fits a memory budget
+def seed_chunks(seed_row_lists, aggregation, n_movies, memory_budget):
+    """
+    Yield (start, end) ranges of consecutive entries. An entry adds one
+    float32 column of n_movies scores per seed with 'max' aggregation and a
+    single column with 'mean'; a chunk always holds at least one entry.
+    """
+    max_columns = max(1, memory_budget // (4 * max(n_movies, 1)))
+    start = 0
+    while start < len(seed_row_lists):
+        end, columns = start, 0
+        while end < len(seed_row_lists):
+            width = len(seed_row_lists[end]) if aggregation == 'max' else 1
+            if end > start and columns + width > max_columns:
+                break
+            columns += width
+            end += 1
+        yield start, end
+        start = end
+
+# Helper function to score the movies most similar to one or more seed lists
+def score_seeded_rows(seed_row_lists, candidate_masks, aggregation='mean', k=6, memory_budget=64 * 2**20):
+    """
+    Return one (rows, scores) pair of up to k rows per seed list, best first.
+
+    With 'mean' aggregation each entry's seed vectors are averaged into one
+    query; with 'max' a movie scores its best similarity to any seed. Either
+    way a chunk of entries is scored with a single sparse x dense product
+    against the TF-IDF matrix, the chunk sized so its similarity slab fits
+    `memory_budget` bytes. Seeds themselves and rows outside each entry's
+    candidate mask are excluded.
+    """
+    models = current_models()
+    vectors = models['similarity_engine'].vectors
+    n_movies = vectors.shape[0]
+    results = []
     
-    try:
-        # Get genres corresponding to the mood
-        mood_related_genres = mood_genres.get(mood, ['Comedy', 'Drama', 'Action'])
+    for start, end in seed_chunks(seed_row_lists, aggregation, n_movies, memory_budget):
+        chunk = seed_row_lists[start:end]
         
-        # Filter movies containing any of the mood-related genres
-        mood_filter = filtered_movies['Genres'].str.contains('|'.join(mood_related_genres), na=False)
-        mood_movies = filtered_movies[mood_filter]
+        query_index = np.repeat(np.arange(len(chunk)), [len(rows) for rows in chunk])
+        seed_rows = np.concatenate(chunk)
+        
+        if aggregation == 'max':
+            # Score against every seed, then keep each query's best seed per movie
+            seed_vectors = vectors[seed_rows]
+            seed_vectors = seed_vectors.toarray() if hasattr(seed_vectors, 'toarray') else np.asarray(seed_vectors)
+            seed_scores = np.asarray(vectors @ seed_vectors.T)
+            seed_offsets = np.concatenate([[0], np.cumsum([len(rows) for rows in chunk])[:-1]])
+            scores = np.maximum.reduceat(seed_scores, seed_offsets, axis=1).T
+        else:
+            # Row b of `weights` averages the seed rows of query b
+            seed_weights = np.concatenate([np.full(len(rows), 1.0 / len(rows), dtype=vectors.dtype)
+                                           for rows in chunk])
+            weights = csr_matrix((seed_weights, (query_index, seed_rows)), shape=(len(chunk), n_movies))
+            queries = weights @ vectors
+            # Kept in the matrix dtype, so the slab below is float32 rather than float64
+            queries = queries.toarray() if hasattr(queries, 'toarray') else np.asarray(queries)
+            queries = queries.astype(vectors.dtype, copy=False)
+            # (n_movies x chunk) similarity slab, one column per query
+            scores = np.asarray(vectors @ queries.T).T
+        allowed = np.vstack(candidate_masks[start:end])
+        allowed[query_index, seed_rows] = False
+        scores = np.where(allowed, scores, -np.inf)
+        
+        top_k = min(k, n_movies)
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        for rows, row_scores in zip(np.take_along_axis(top, order, axis=1),
+                                    np.take_along_axis(top_scores, order, axis=1)):
+            finite = np.isfinite(row_scores)
+            results.append((rows[finite], row_scores[finite]))
+    
+    return results
+
+# Helper function to check that a user has a latent factor vector
+def is_known_user(user_id):
+    models = current_models()
+    return user_id is not None and 'factor_rows' in models and 0 <= user_id < len(models['user_features'])
+
+# Collaborative-filtering recommendations for one or more users
+def get_personalized_recommendations(user_ids, candidate_masks, num_recommendations=6, chunk_size=256):
+    """
+    Recommend the movies whose latent factors score highest against each
+    user's factor vector, restricted to the user's candidate mask.
+
+    A user's precomputed top-K list (`python build.py personalized`) is used
+    when enough of it survives the filters; the remaining users are scored
+    live, a chunk at a time, with one float32 matrix product.
+    """
+    models = current_models()
+    if not all(is_known_user(user_id) for user_id in user_ids):
+        raise ValueError('Unknown userId for personalized recommendations')
+    
+    factor_rows = models['factor_rows']
+    in_catalog = factor_rows >= 0
+    top_ids = models.get('personalized_ids')
+    results = [None] * len(user_ids)
+    
+    # Factor rows each user may be recommended
+    allowed = []
+    for candidate_mask in candidate_masks:
+        user_allowed = in_catalog.copy()
+        user_allowed[in_catalog] = candidate_mask[factor_rows[in_catalog]]
+        allowed.append(user_allowed)
+    
+    live = []
+    for i, user_id in enumerate(user_ids):
+        if top_ids is not None and user_id < len(top_ids):
+            rows = np.asarray(top_ids[user_id])
+            rows = rows[rows >= 0]
+            rows = rows[allowed[i][rows]][:num_recommendations]
+            if len(rows) == num_recommendations:
+                results[i] = format_recommendations(factor_rows[rows])
+                continue
+        live.append(i)
+    
+    for start in range(0, len(live), chunk_size):
+        chunk = live[start:start + chunk_size]
+        user_vectors = np.asarray(models['user_features'][[user_ids[i] for i in chunk]], dtype=np.float32)
+        ids, _ = top_k_scores(user_vectors, models['movie_factors'], num_recommendations,
+                              np.vstack([allowed[i] for i in chunk]))
+        for i, rows in zip(chunk, ids):
+            results[i] = format_recommendations(factor_rows[rows[rows >= 0]])
+    
+    return results
+
+# Helper function to select the movies matching a mood, and the order to rank them in
+def get_mood_selection(candidate_mask, mood):
+    models = current_models()
+    catalog = models['catalog']
+    
+    # Get the precompiled genre bitmask corresponding to the mood
+    mood_bits = catalog['mood_bits'].get(mood, catalog['mood_bits'][DEFAULT_MOOD])
+    
+    # Keep movies containing any of the mood-related genres, ranked by rating
+    return candidate_mask & bits_mask(catalog, mood_bits), catalog['orders']['rating']
+
+# Mood-based recommendations
+def get_mood_based_recommendations(candidate_mask, mood, num_recommendations=6):
+    try:
+        mood_mask, order = get_mood_selection(candidate_mask, mood)
         
         # Sort by rating and get top recommendations
-        mood_recommendations = mood_movies.sort_values('VoteAverage', ascending=False).head(num_recommendations)
+        mood_recommendations = first_rows(order, mood_mask, n=num_recommendations)
         
         # Format recommendations for frontend
-        recommendations = format_recommendations(mood_recommendations)
-        
-        return recommendations
+        return format_recommendations(mood_recommendations)
     except Exception as e:
         print(f"Error in mood-based recommendations: {e}")
-        return get_basic_recommendations(filtered_movies)
+        count_fallback('mood')
+        return get_basic_recommendations(candidate_mask)
+
+# Helper function to select the movies of a discovery type, and the order to rank them in
+def get_discovery_selection(candidate_mask, discovery_type):
+    models = current_models()
+    catalog = models['catalog']
+    orders = catalog['orders']
+    rating = catalog['rating']
+    popularity = catalog['popularity']
+    year = catalog['year']
+    
+    if discovery_type == 'hidden':
+        # Hidden gems: high-rated but lesser-known, ranked by gem score
+        return candidate_mask & (popularity < 30) & (rating >= 7.0), orders['hidden']
+        
+    elif discovery_type == 'underrated':
+        # Underrated: decent rating but lower popularity, ranked by underrated score
+        return candidate_mask & (popularity < 50) & (rating >= 6.5), orders['underrated']
+        
+    elif discovery_type == 'cult':
+        # Cult classics: older movies with passionate followings, ranked by cult score
+        return candidate_mask & (year < 2010) & (rating >= 7.0), orders['cult']
+        
+    elif discovery_type == 'awards':
+        # Award winners (proxy: high ratings)
+        return candidate_mask & (rating >= 8.0), orders['rating']
+    
+    return candidate_mask, None
 
 # Discovery recommendations
-def get_discovery_recommendations(filtered_movies, discovery_type, num_recommendations=6):
+def get_discovery_recommendations(candidate_mask, discovery_type, num_recommendations=6):
     try:
-        discovery_movies = filtered_movies.copy()
-        
-        if discovery_type == 'hidden':
-            # Hidden gems: high-rated but lesser-known
-            discovery_movies = discovery_movies[
-                (discovery_movies['Popularity'] < 30) &
-                (discovery_movies['VoteAverage'] >= 7.0)
-            ]
-            # Calculate gem score
-            discovery_movies['SpecialScore'] = (
-                (discovery_movies['VoteAverage'] - 7.0) / 3 +  # Rating component
-                (1 - (discovery_movies['Popularity'] / 30))  # Popularity component
-            )
-            discovery_movies = discovery_movies.sort_values('SpecialScore', ascending=False)
-            
-        elif discovery_type == 'underrated':
-            # Underrated: decent rating but lower popularity
-            discovery_movies = discovery_movies[
-                (discovery_movies['Popularity'] < 50) &
-                (discovery_movies['VoteAverage'] >= 6.5)
-            ]
-            # Calculate underrated score
-            discovery_movies['SpecialScore'] = (
-                discovery_movies['VoteAverage'] / 10 *
-                (1 - (discovery_movies['Popularity'] / 100))
-            )
-            discovery_movies = discovery_movies.sort_values('SpecialScore', ascending=False)
-            
-        elif discovery_type == 'cult':
-            # Cult classics: older movies with passionate followings
-            discovery_movies = discovery_movies[
-                (discovery_movies['ReleaseYear'] < 2010) &
-                (discovery_movies['VoteAverage'] >= 7.0)
-            ]
-            # Calculate cult score
-            discovery_movies['SpecialScore'] = (
-                discovery_movies['VoteAverage'] / 10 *
-                (1 - (discovery_movies['ReleaseYear'] / 2025))
-            )
-            discovery_movies = discovery_movies.sort_values('SpecialScore', ascending=False)
-            
-        elif discovery_type == 'awards':
-            # Award winners (proxy: high ratings)
-            discovery_movies = discovery_movies[discovery_movies['VoteAverage'] >= 8.0]
-            discovery_movies = discovery_movies.sort_values('VoteAverage', ascending=False)
+        discovery_mask, order = get_discovery_selection(candidate_mask, discovery_type)
         
         # Get top recommendations
-        top_discoveries = discovery_movies.head(num_recommendations)
+        top_discoveries = first_rows(order, discovery_mask, n=num_recommendations)
         
         # Format recommendations for frontend
-        recommendations = format_recommendations(top_discoveries)
-        
-        return recommendations
+        return format_recommendations(top_discoveries)
     except Exception as e:
         print(f"Error in discovery recommendations: {e}")
-        return get_basic_recommendations(filtered_movies)
+        count_fallback('discovery')
+        return get_basic_recommendations(candidate_mask)
+
+# Helper function to select the movies of a region, and the order to rank them in
+def get_regional_selection(candidate_mask, region):
+    models = current_models()
+    catalog = models['catalog']
+    return candidate_mask & region_mask(catalog, region), catalog['orders']['rating']
 
 # Regional recommendations
-def get_regional_recommendations(filtered_movies, region, num_recommendations=6):
+def get_regional_recommendations(candidate_mask, region, num_recommendations=6):
     try:
         # Filter by selected region
-        regional_movies = filtered_movies[filtered_movies['Region'] == region]
+        regional_mask, order = get_regional_selection(candidate_mask, region)
         
-        # Sort by rating and get top recommendations
-        top_regional = regional_movies.sort_values('VoteAverage', ascending=False).head(num_recommendations)
+        # Walk the rating order and get top recommendations
+        top_regional = first_rows(order, regional_mask, n=num_recommendations)
         
         # Format recommendations for frontend
-        recommendations = format_recommendations(top_regional)
-        
-        return recommendations
+        return format_recommendations(top_regional)
     except Exception as e:
         print(f"Error in regional recommendations: {e}")
-        return get_basic_recommendations(filtered_movies)
+        count_fallback('regional')
+        return get_basic_recommendations(candidate_mask)
+
+# Two-stage recommendations: generate candidates, then re-rank them on blended signals
+def get_reranked_recommendations(preferences, candidate_mask, seed_rows, num_recommendations=6):
+    """
+    Generate up to RERANK_CANDIDATES rows with the requested mode's own
+    criterion, then let the hybrid re-ranker (rerank.py) pick the final list
+    from similarity, factor score, rating, popularity and recency, with MMR
+    diversity over the TF-IDF vectors.
+    """
+    models = current_models()
+    catalog = models['catalog']
+    engine = models.get('similarity_engine')
+    recommendation_type = preferences['recommendation_type']
+    sub_type = preferences['sub_type']
+    user_id = preferences['user_id']
+    similarity = factor = None
+    
+    if len(seed_rows):
+        rows, similarity = score_seeded_rows(
+            [seed_rows], [candidate_mask], preferences['seed_aggregation'], k=RERANK_CANDIDATES)[0]
+    elif recommendation_type == 'content':
+        candidates = np.flatnonzero(candidate_mask)
+        if len(candidates) == 0 or engine is None:
+            count_fallback('content')
+            return get_basic_recommendations(candidate_mask)
+        reference_row = candidates[random.randint(0, len(candidates) - 1)]
+        rows, similarity = engine.search_row(reference_row, k=RERANK_CANDIDATES)
+        keep = candidate_mask[rows]
+        rows, similarity = rows[keep], similarity[keep]
+    elif recommendation_type == 'personalized':
+        if not is_known_user(user_id):
+            raise ValueError('Unknown userId for personalized recommendations')
+        factor_rows = models['factor_rows']
+        allowed = factor_rows >= 0
+        allowed[allowed] = candidate_mask[factor_rows[allowed]]
+        user_vector = np.asarray(models['user_features'][[user_id]], dtype=np.float32)
+        ids, scores = top_k_scores(user_vector, models['movie_factors'], RERANK_CANDIDATES, allowed)
+        found = ids[0] >= 0
+        rows, factor = factor_rows[ids[0][found]], scores[0][found]
+    else:
+        if recommendation_type == 'mood':
+            mask, order = get_mood_selection(candidate_mask, sub_type)
+        elif recommendation_type == 'discovery':
+            mask, order = get_discovery_selection(candidate_mask, sub_type)
+        elif recommendation_type == 'regional':
+            mask, order = get_regional_selection(candidate_mask, sub_type)
+        else:
+            mask, order = candidate_mask, catalog['orders']['basic']
+        rows = first_rows(order, mask, n=RERANK_CANDIDATES)
+    
+    with STAGES['rerank'].time():
+        rows = np.asarray(rows, dtype=np.int64)
+        if factor is None and is_known_user(user_id):
+            factor = get_factor_scores(user_id, rows)
+        signals = candidate_signals(catalog, rows, similarity, factor)
+        rows = rerank(rows, signals, preferences['rerank'], n=num_recommendations,
+                      vectors=engine.vectors if engine is not None else None)
+    
+    return format_recommendations(rows)
+
+# Helper function to score catalog rows against a user's factors (NaN for rows without factors)
+def get_factor_scores(user_id, rows):
+    models = current_models()
+    factor_rows = models['catalog_factor_rows'][rows]
+    scores = np.full(len(rows), np.nan, dtype=np.float32)
+    has_factors = factor_rows >= 0
+    user_vector = np.asarray(models['user_features'][user_id], dtype=np.float32)
+    scores[has_factors] = models['movie_factors'][factor_rows[has_factors]] @ user_vector
+    return scores
 
 # Basic recommendations (fallback)
-def get_basic_recommendations(filtered_movies, num_recommendations=6):
+def get_basic_recommendations(candidate_mask, num_recommendations=6):
+    models = current_models()
     try:
-        # Sort by popularity and rating
-        top_movies = filtered_movies.sort_values(['VoteAverage', 'Popularity'], ascending=[False, False])
+        catalog = models['catalog']
         
-        # Take top N recommendations
-        top_recommendations = top_movies.head(num_recommendations)
+        # Walk the rating-then-popularity order and take top N recommendations
+        top_movies = first_rows(catalog['orders']['basic'], candidate_mask, n=num_recommendations)
         
         # Format recommendations for frontend
-        recommendations = format_recommendations(top_recommendations)
-        
-        return recommendations
+        return format_recommendations(top_movies)
     except Exception as e:
         print(f"Error in basic recommendations: {e}")
         # Return an empty list if all else fails
         return []
 
 # Helper function to format recommendations for frontend
-def format_recommendations(movies_df):
-    recommendations = []
+def format_recommendations(rows):
+    """
+    Build response records for catalog rows from the preprocessed display
+    columns; all per-column work is a single vectorized gather (text columns
+    of a memory-mapped bundle decode only the requested rows).
+    """
+    models = current_models()
+    started = time.perf_counter()
+    catalog = models['catalog']
+    rows = np.asarray(rows, dtype=np.int64)
     
-    for _, movie in movies_df.iterrows():
-        # Extract and format genres
-        genres = []
-        if isinstance(movie['Genres'], str):
-            genres = movie['Genres'].split('|')
-        
-        # Create recommendation object
-        recommendation = {
-            'title': movie['Title'],
+    columns = zip(
+        catalog['display_title'].take(rows).tolist(),
+        catalog['display_genres'].take(rows).tolist(),
+        catalog['display_year'].take(rows).tolist(),
+        # Rounded in float64, so a stored 6.3 is sent as 6.3 rather than 6.300000190734863
+        np.round(catalog['display_rating'].take(rows).astype(np.float64), RATING_DECIMALS).tolist(),
+        catalog['display_overview'].take(rows).tolist(),
+        REGION_NAMES[catalog['region'].take(rows)].tolist(),
+    )
+    recommendations = [
+        {
+            'title': title,
             'genres': genres,
-            'year': int(movie['ReleaseYear']) if 'ReleaseYear' in movie and not pd.isna(movie['ReleaseYear']) else 0,
-            'rating': float(movie['VoteAverage']) if 'VoteAverage' in movie and not pd.isna(movie['VoteAverage']) else 0.0,
-            'overview': movie['Overview'] if 'Overview' in movie else "",
-            'region': movie['Region'] if 'Region' in movie else "Hollywood",
-            'posterPath': os.path.join('/static', 'img', 'no-poster.jpg')
+            'year': year,
+            'rating': rating,
+            'overview': overview,
+            'region': region,
+            'posterPath': POSTER_PLACEHOLDER,
         }
-        
-        recommendations.append(recommendation)
-    
+        for title, genres, year, rating, overview, region in columns
+    ]
+    STAGES['format'].observe(time.perf_counter() - started)
     return recommendations
 
+# Helper function to encode a response body as JSON bytes
+def encode_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode('utf-8')
+
 # Serve static files from the static folder
 @app.route('/static/<path:path>')
 def serve_static(path):
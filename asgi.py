@@ -0,0 +1,282 @@
+"""
+ASGI entry point for Movie MatchMaker: `uvicorn asgi:app`.
+
+POST /api/recommendations has the same request and response contract as
+the Flask route, but it never blocks the event loop:
+
+- Scoring (NumPy/SciPy, which release the GIL) runs on a bounded thread
+  pool of SCORING_THREADS threads.
+- Identical requests that arrive while one is being computed wait for that
+  computation instead of starting their own.
+- At most MAX_PENDING computations are running or queued. A request that
+  cannot get a slot within QUEUE_TIMEOUT seconds, or whose answer takes
+  longer than SCORING_TIMEOUT seconds, gets a degraded answer: its cached
+  response if there is one, otherwise the cached unfiltered basic
+  recommendations. Degraded responses carry an `X-Degraded` header
+  (`overloaded` or `timeout`).
+- Request bodies larger than MAX_BODY_SIZE bytes are refused with 413,
+  without reading the rest of them.
+
+Every other route is served by the Flask app through a minimal WSGI
+bridge on the same pool, so the frontend, search, ingestion and /metrics
+all work unchanged.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from flask import g
+
+import app as movie_app
+from app import cache_key, filter_key, get_basic_recommendations, get_recommendation_body, parse_preferences
+
+flask_app = movie_app.app
+
+SCORING_THREADS = int(os.environ.get('SCORING_THREADS', os.cpu_count() or 1))
+MAX_PENDING = int(os.environ.get('MAX_PENDING', 4 * SCORING_THREADS))
+QUEUE_TIMEOUT = float(os.environ.get('QUEUE_TIMEOUT', 0.1))
+SCORING_TIMEOUT = float(os.environ.get('SCORING_TIMEOUT', 2.0))
+MAX_BODY_SIZE = int(os.environ.get('MAX_BODY_SIZE', 2**20))
+
+RECOMMENDATIONS_PATH = '/api/recommendations'
+JSON_HEADERS = [(b'content-type', b'application/json')]
+
+degraded_total = movie_app.metrics.counter(
+    'movie_matchmaker_degraded_responses', 'Recommendations answered with a degraded fallback, by reason.',
+    ('reason',))
+coalesced_total = movie_app.metrics.counter(
+    'movie_matchmaker_coalesced_requests', 'Recommendation requests that joined an identical one in flight.')
+
+
+class RecommendationServer:
+    """Scoring pool, in-flight table and admission limit of one ASGI worker process."""
+
+    def __init__(self, threads=SCORING_THREADS, max_pending=MAX_PENDING, queue_timeout=QUEUE_TIMEOUT,
+                 scoring_timeout=SCORING_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='scoring')
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.scoring_timeout = scoring_timeout
+        self.in_flight = {}
+        self._slots = None
+        self._fallback = (None, None)
+
+    @property
+    def slots(self):
+        # Created lazily so the semaphore belongs to the server's event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return self._slots
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+        elif scope['path'] == RECOMMENDATIONS_PATH and scope['method'] == 'POST':
+            await self.recommendations(receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def recommendations(self, receive, send):
+        started = time.perf_counter()
+        body = await read_body(receive)
+        if body is None:
+            return await self.respond(send, started, 413, body_too_large())
+        parse_started = time.perf_counter()
+        try:
+            user_preferences = json.loads(body)
+        except ValueError:
+            user_preferences = None
+        if not isinstance(user_preferences, dict):
+            return await self.respond(send, started, 400, encode_error('Expected a JSON object'))
+
+        # The snapshot is pinned here, so a concurrent ingest cannot change it mid-request
+        snapshot = movie_app.models
+        if 'catalog' not in snapshot:
+            return await self.respond(send, started, 500, encode_error('Movie data not available'))
+        try:
+            preferences = parse_preferences(user_preferences)
+        except ValueError as e:
+            return await self.respond(send, started, 400, encode_error(str(e)))
+        # Same stage as the Flask route: JSON decoding plus preference parsing
+        movie_app.STAGES['parse'].observe(time.perf_counter() - parse_started)
+
+        key = (snapshot.get('generation', 0),) + coalesce_key(preferences)
+        future = self.in_flight.get(key)
+        if future is not None:
+            coalesced_total.labels().inc()
+        else:
+            try:
+                await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return await self.respond_degraded(send, started, snapshot, preferences, 'overloaded')
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, compute_body, snapshot, preferences)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self.finish(key, done))
+
+        try:
+            # Shielded: a timed-out request leaves the computation running for the others
+            body = await asyncio.wait_for(asyncio.shield(future), self.scoring_timeout)
+        except asyncio.TimeoutError:
+            return await self.respond_degraded(send, started, snapshot, preferences, 'timeout')
+        except Exception as e:
+            print(f"Error generating recommendations: {e}")
+            return await self.respond(send, started, 500, encode_error('Recommendations failed'))
+        await self.respond(send, started, 200, body)
+
+    def finish(self, key, future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+        self.slots.release()
+        if not future.cancelled():
+            # Retrieve the error even if every waiter timed out, or asyncio logs it as never retrieved
+            future.exception()
+
+    async def respond_degraded(self, send, started, snapshot, preferences, reason):
+        degraded_total.labels(reason=reason).inc()
+        body = self.fallback_body(snapshot, preferences)
+        await self.respond(send, started, 200, body, [(b'x-degraded', reason.encode('ascii'))])
+
+    def fallback_body(self, snapshot, preferences):
+        """The cached response for these preferences, else the cached unfiltered basic recommendations."""
+        key = cache_key(preferences)
+        if key is not None:
+            cached_body = movie_app.response_cache.get((snapshot.get('generation', 0),) + key)
+            if cached_body is not None:
+                return cached_body
+        generation, body = self._fallback
+        if generation != snapshot.get('generation', 0):
+            # Reads ordering arrays only, so it is cheap enough for the event loop
+            with flask_app.app_context():
+                g.models = snapshot
+                catalog = snapshot['catalog']
+                body = movie_app.encode_json(get_basic_recommendations(np.ones(catalog['size'], dtype=bool)))
+            self._fallback = (snapshot.get('generation', 0), body)
+        return body
+
+    async def respond(self, send, started, status, body, headers=()):
+        await send({'type': 'http.response.start', 'status': status, 'headers': JSON_HEADERS + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+        movie_app.request_seconds.labels(endpoint=RECOMMENDATIONS_PATH).observe(time.perf_counter() - started)
+        movie_app.requests_total.labels(endpoint=RECOMMENDATIONS_PATH, status=status).inc()
+
+    async def wsgi(self, scope, receive, send):
+        body = await read_body(receive)
+        if body is None:
+            await send({'type': 'http.response.start', 'status': 413, 'headers': JSON_HEADERS})
+            await send({'type': 'http.response.body', 'body': body_too_large()})
+            return
+        environ = wsgi_environ(scope, body)
+        status, headers, body = await asyncio.get_running_loop().run_in_executor(self.executor, call_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def coalesce_key(preferences):
+    """Key under which identical in-flight requests share one computation."""
+    key = cache_key(preferences)
+    if key is not None:
+        return key
+    # Uncached modes (content picks a random reference movie) can still share one pick while in flight
+    rerank = tuple(sorted(preferences['rerank'].items())) if preferences['rerank'] is not None else ()
+    return ('uncached', str(preferences['recommendation_type']), str(preferences['sub_type'])) + \
+        filter_key(preferences) + rerank
+
+
+def compute_body(snapshot, preferences):
+    # Runs on a scoring thread, inside an app context pinned to the request's snapshot
+    with flask_app.app_context():
+        g.models = snapshot
+        return get_recommendation_body(preferences)
+
+
+def encode_error(message):
+    return json.dumps({'error': message}).encode('utf-8')
+
+
+def body_too_large():
+    return encode_error(f'Request bodies are limited to {MAX_BODY_SIZE} bytes')
+
+
+async def read_body(receive, max_size=None):
+    """The request body, or None as soon as it grows past `max_size` bytes (MAX_BODY_SIZE by default)."""
+    max_size = MAX_BODY_SIZE if max_size is None else max_size
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > max_size:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope (PEP 3333 strings are latin-1 decoded bytes)."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """Run the Flask app on one environ; returns (status code, headers, body)."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'], response['headers'] = int(status.split(' ', 1)[0]), headers
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+app = RecommendationServer()
@@ -0,0 +1,639 @@
+"""Benchmarks for the Movie MatchMaker recommendation paths.
+
+Usage:
+    python benchmark.py generate --movies 100000 [--users 1000] [--seed 0] [--out bench/100k]
+    python benchmark.py run [--dir bench/100k] [--requests 1000] [--json results.json]
+    python benchmark.py load [--dir bench/100k] [--concurrency 1 4 16 64] [--limits 8 32] [--url URL]
+    python benchmark.py compare BASELINE.json CANDIDATE.json [--threshold 10]
+
+`generate` writes a synthetic catalog (data/movies2024.csv) with skewed
+genre, popularity, rating and release year distributions, a TF-IDF matrix
+over the vocabulary of the shipped vectorizer, and latent factors, laid out
+like the repository's data/ and models/ directories. The build steps can be
+run on it as usual, e.g.
+`python build.py --data-dir bench/100k/data --models-dir bench/100k/models bundle`.
+
+`run` loads the app on a catalog (the repository's own by default) and
+drives every recommendation path through the Flask test client and as
+direct function calls, reporting p50/p99 latency, throughput and peak
+memory. Results saved with --json can be compared between commits.
+
+`load` runs a closed-loop load test of the Flask app (a thread per client)
+and the ASGI app in asgi.py (bounded scoring pool, coalescing and
+backpressure) at increasing client concurrency, in process; with --url it
+loads a running server over HTTP instead (e.g. `gunicorn app:app` vs
+`uvicorn asgi:app`).
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import json
+import os
+import pickle
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from catalog import MOOD_GENRES, REGIONS
+from factors import FACTOR_IDS_FILE
+from similarity import normalize_rows
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+SYNTHETIC_FILE = 'synthetic.json'
+
+# Relative genre frequencies, roughly those of TMDB
+GENRE_WEIGHTS = {
+    'Drama': 0.26, 'Comedy': 0.17, 'Thriller': 0.09, 'Action': 0.08, 'Romance': 0.07, 'Horror': 0.07,
+    'Documentary': 0.05, 'Crime': 0.05, 'Adventure': 0.04, 'Family': 0.03, 'Science Fiction': 0.03,
+    'Animation': 0.03, 'Mystery': 0.03, 'Fantasy': 0.03, 'Music': 0.02, 'History': 0.01, 'War': 0.01,
+    'TV Movie': 0.01, 'Western': 0.01,
+}
+GENRE_COUNT_WEIGHTS = (0.35, 0.40, 0.25)  # 1, 2 or 3 genres per movie
+REGION_WEIGHTS = {'Hollywood': 0.70, 'Bollywood': 0.15, 'Tollywood': 0.08, 'Kollywood': 0.07}
+MEAN_TERMS = 15  # Non-zero TF-IDF terms per movie, as in the shipped matrix
+
+DISCOVERY_TYPES = ('hidden', 'underrated', 'cult', 'awards')
+# Filters cycled through by every path, so each is measured on selective and broad masks
+FILTER_VARIANTS = (
+    {},
+    {'genre': 'Drama'},
+    {'timePeriod': 'recent'},
+    {'rating': 'high-rated', 'popularity': 'popular'},
+)
+
+
+# Synthetic catalog
+def load_vocabulary(models_dir=MODELS_DIR):
+    """Terms (by column) and idf weights of the shipped TF-IDF vectorizer."""
+    with open(os.path.join(models_dir, 'tfidf_vectorizer.pkl'), 'rb') as f:
+        vectorizer = pickle.load(f)
+    terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    return terms, vectorizer.idf_
+
+
+def synthetic_movies(rng, first_id, n_movies, terms, term_p, idf):
+    """
+    One chunk of synthetic movies: (DataFrame of CSV columns, TF-IDF rows).
+
+    Overviews are drawn from the vectorizer's vocabulary with Zipf-like term
+    frequencies, and the TF-IDF rows are computed from the same draws.
+    """
+    lengths = np.maximum(rng.poisson(MEAN_TERMS, n_movies), 3)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    drawn = rng.choice(len(terms), size=indptr[-1], p=term_p)
+    words = terms[drawn]
+    overviews = [' '.join(words[start:stop]) for start, stop in zip(indptr[:-1], indptr[1:])]
+    # Repeated terms are summed into tf * idf, then rows are L2-normalized like TfidfVectorizer's
+    matrix = sparse.csr_matrix((idf[drawn], drawn, indptr), shape=(n_movies, len(terms)))
+    matrix.sum_duplicates()
+    matrix = normalize_rows(matrix)
+
+    genre_names = np.array(list(GENRE_WEIGHTS), dtype=object)
+    genre_p = np.array(list(GENRE_WEIGHTS.values()))
+    genre_p /= genre_p.sum()
+    genre_counts = rng.choice(len(GENRE_COUNT_WEIGHTS), size=n_movies, p=GENRE_COUNT_WEIGHTS) + 1
+    genres = [', '.join(rng.choice(genre_names, size=count, replace=False, p=genre_p)) for count in genre_counts]
+
+    year = np.maximum(2024 - np.floor(rng.exponential(18, n_movies)), 1920)
+    year[rng.random(n_movies) < 0.01] = np.nan
+    rating = np.clip(np.round(rng.normal(6.4, 1.1, n_movies), 1), 1.0, 10.0)
+    rating[rng.random(n_movies) < 0.03] = 0.0  # Unrated
+    popularity = rng.lognormal(2.3, 1.1, n_movies)
+
+    title_words = terms[rng.integers(0, len(terms), size=(n_movies, 2))]
+    regions = rng.choice(list(REGION_WEIGHTS), size=n_movies, p=list(REGION_WEIGHTS.values()))
+    movies_df = pd.DataFrame({
+        'MovieID': np.arange(first_id, first_id + n_movies, dtype=np.int64),
+        'Title': [f"{first.title()} {second.title()}" for first, second in title_words],
+        'Genres': genres,
+        'ReleaseYear': year,
+        'VoteAverage': rating,
+        'Popularity': popularity,
+        'Overview': overviews,
+        'Actors': [f"Actor {a}, Actor {b}" for a, b in rng.integers(0, 50000, size=(n_movies, 2))],
+        'Directors': [f"Director {d}" for d in rng.integers(0, 10000, size=n_movies)],
+        'Region': regions,
+    })
+    return movies_df, matrix
+
+
+def generate_catalog(out_dir, n_movies, n_users=1000, n_factors=30, seed=0, chunk_size=50000):
+    """
+    Write a synthetic catalog of `n_movies` to out_dir/data and out_dir/models.
+
+    Movies are generated and appended to the CSV in chunks, so memory is
+    bounded by the TF-IDF matrix and factors rather than the text columns.
+    """
+    data_dir = os.path.join(out_dir, 'data')
+    models_dir = os.path.join(out_dir, 'models')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(models_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    terms, idf = load_vocabulary()
+    # Common terms (low idf) are drawn most often
+    ranks = np.empty(len(terms))
+    ranks[np.argsort(idf, kind='stable')] = np.arange(len(terms))
+    term_p = 1.0 / (ranks + 10)
+    term_p /= term_p.sum()
+
+    movies_path = os.path.join(data_dir, 'movies2024.csv')
+    tmp_path = movies_path + '.tmp'
+    matrices = []
+    for start in range(0, n_movies, chunk_size):
+        movies_df, matrix = synthetic_movies(rng, 1 + start, min(chunk_size, n_movies - start), terms, term_p, idf)
+        movies_df.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+        matrices.append(matrix)
+    os.replace(tmp_path, movies_path)
+
+    sparse.save_npz(os.path.join(models_dir, 'tfidf_matrix.npz'), sparse.vstack(matrices, format='csr'))
+    del matrices
+    shutil.copy(os.path.join(MODELS_DIR, 'tfidf_vectorizer.pkl'), models_dir)
+    np.save(os.path.join(models_dir, 'movie_features.npy'),
+            rng.normal(0, 0.3, (n_movies, n_factors)).astype(np.float16))
+    np.save(os.path.join(models_dir, FACTOR_IDS_FILE), np.arange(1, n_movies + 1, dtype=np.int64))
+    np.save(os.path.join(models_dir, 'user_features.npy'),
+            rng.normal(0, 0.3, (n_users, n_factors)).astype(np.float16))
+
+    spec = {'movies': n_movies, 'users': n_users, 'factors': n_factors, 'seed': seed}
+    with open(os.path.join(out_dir, SYNTHETIC_FILE), 'w') as f:
+        json.dump(spec, f, indent=2)
+    return spec
+
+
+def cmd_generate(args):
+    out_dir = args.out or os.path.join(BASE_DIR, 'bench', f"{args.movies}")
+    start = time.perf_counter()
+    generate_catalog(out_dir, args.movies, n_users=args.users, n_factors=args.factors, seed=args.seed,
+                     chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {args.movies} synthetic movies and {args.users} users to {out_dir} in {elapsed:.1f}s")
+
+
+# Benchmark run
+def benchmark_requests(n_users):
+    """(path, request body) pairs for every recommendation path the app serves."""
+    paths = [('content', {'recommendationType': 'content'})]
+    paths += [(f"mood:{mood}", {'recommendationType': 'mood', 'subType': mood}) for mood in MOOD_GENRES]
+    paths += [(f"discovery:{kind}", {'recommendationType': 'discovery', 'subType': kind})
+              for kind in DISCOVERY_TYPES]
+    paths += [(f"regional:{region}", {'recommendationType': 'regional', 'subType': region}) for region in REGIONS]
+    paths.append(('basic', {}))
+    if n_users:
+        paths.append(('personalized', {'recommendationType': 'personalized'}))
+    return paths
+
+
+def path_bodies(body, n_requests, n_users):
+    """Request bodies for one path, cycling through the filter variants (and users)."""
+    bodies = []
+    for i in range(n_requests):
+        variant = dict(body, **FILTER_VARIANTS[i % len(FILTER_VARIANTS)])
+        if n_users:
+            variant['userId'] = i % n_users
+        bodies.append(variant)
+    return bodies
+
+
+def direct_call(app_module, preferences):
+    """Compute one request's recommendations by calling the mode functions, without Flask or JSON."""
+    mask = app_module.get_candidate_mask(preferences)
+    kind, sub_type = preferences['recommendation_type'], preferences['sub_type']
+    if kind == 'content':
+        return app_module.get_content_based_recommendations(mask, sub_type)
+    if kind == 'personalized':
+        return app_module.get_personalized_recommendations([preferences['user_id']], [mask])[0]
+    if kind == 'mood':
+        return app_module.get_mood_based_recommendations(mask, sub_type)
+    if kind == 'discovery':
+        return app_module.get_discovery_recommendations(mask, sub_type)
+    if kind == 'regional':
+        return app_module.get_regional_recommendations(mask, sub_type)
+    return app_module.get_basic_recommendations(mask)
+
+
+def measure(call, items, warmup):
+    """Latencies (ms) of call(item) over items, after `warmup` untimed calls; and the wall time."""
+    for item in items[:warmup]:
+        call(item)
+    latencies = np.empty(len(items))
+    started = time.perf_counter()
+    for i, item in enumerate(items):
+        call_started = time.perf_counter()
+        call(item)
+        latencies[i] = time.perf_counter() - call_started
+    return latencies * 1000, time.perf_counter() - started
+
+
+def peak_allocation(call, items):
+    """Peak bytes allocated (tracemalloc) while calling call(item) over items."""
+    tracemalloc.start()
+    try:
+        for item in items:
+            call(item)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(catalog_dir=None, n_requests=1000, warmup=50, memory_requests=100, interfaces=('http', 'direct'),
+                  path_filter=None, seed=0):
+    """
+    Load the app and benchmark every recommendation path. Returns the results dict.
+
+    The response cache is off unless RECOMMENDATION_CACHE_SIZE is set, so
+    repeated bodies measure the recommendation work rather than cache hits.
+    """
+    if catalog_dir:
+        os.environ['MODELS_DIR'] = os.path.join(catalog_dir, 'models')
+        os.environ['DATA_DIR'] = os.path.join(catalog_dir, 'data')
+    os.environ.setdefault('RECOMMENDATION_CACHE_SIZE', '0')
+    # The app logs every request; keep that out of the measurements
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        import app as app_module
+        load_seconds = time.perf_counter() - started
+        rss_after_load = max_rss_mb()
+
+        models = app_module.models
+        if 'catalog' not in models:
+            raise RuntimeError('The app did not load a movie catalog')
+        n_users = len(models['user_features']) if 'factor_rows' in models else 0
+        client = app_module.app.test_client()
+        interface_calls = {
+            'http': lambda body: client.post('/api/recommendations', json=body),
+            'direct': lambda preferences: direct_call(app_module, preferences),
+        }
+
+        results = []
+        for path, body in benchmark_requests(n_users):
+            if path_filter and not any(path.startswith(prefix) for prefix in path_filter):
+                continue
+            bodies = path_bodies(body, n_requests, n_users)
+            for interface in interfaces:
+                items = bodies if interface == 'http' else [app_module.parse_preferences(b) for b in bodies]
+                # Content recommendations pick a random reference movie
+                random.seed(seed)
+                latencies, wall = measure(interface_calls[interface], items, warmup)
+                peak = peak_allocation(interface_calls[interface], items[:memory_requests])
+                results.append({
+                    'path': path,
+                    'interface': interface,
+                    'requests': len(items),
+                    'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+                    'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+                    'mean_ms': round(float(latencies.mean()), 4),
+                    'throughput_rps': round(len(items) / wall, 1),
+                    'peak_alloc_kb': round(peak / 1024, 1),
+                })
+
+    spec = None
+    spec_path = os.path.join(catalog_dir, SYNTHETIC_FILE) if catalog_dir else None
+    if spec_path and os.path.isfile(spec_path):
+        with open(spec_path) as f:
+            spec = json.load(f)
+    return {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'catalog': {'dir': catalog_dir, 'movies': int(models['catalog']['size']), 'users': n_users,
+                    'synthetic': spec},
+        'load_seconds': round(load_seconds, 3),
+        'rss_after_load_mb': round(rss_after_load, 1),
+        'peak_rss_mb': round(max_rss_mb(), 1),
+        'results': results,
+    }
+
+
+def print_results(report):
+    catalog = report['catalog']
+    print(f"revision {report['revision']}, {catalog['movies']} movies, {catalog['users']} users, "
+          f"loaded in {report['load_seconds']:.2f}s, RSS {report['rss_after_load_mb']:.0f} MB after load, "
+          f"peak {report['peak_rss_mb']:.0f} MB")
+    print(f"\n{'path':<22}{'interface':<10}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>10}{'peak KB':>10}")
+    for line in report['results']:
+        print(f"{line['path']:<22}{line['interface']:<10}{line['p50_ms']:>9.3f}{line['p99_ms']:>9.3f}"
+              f"{line['throughput_rps']:>10,.0f}{line['peak_alloc_kb']:>10,.0f}")
+
+
+def cmd_run(args):
+    report = run_benchmark(args.dir, n_requests=args.requests, warmup=args.warmup,
+                           memory_requests=args.memory_requests, interfaces=args.interfaces,
+                           path_filter=args.paths, seed=args.seed)
+    print_results(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+# Load test
+def load_payloads(n_users, count=1000, seed=0):
+    """A random mix of request bodies over all paths and filters; repeats are intended (and coalescable)."""
+    rng = random.Random(seed)
+    paths = benchmark_requests(n_users)
+    payloads = []
+    for _ in range(count):
+        body = dict(rng.choice(paths)[1], **rng.choice(FILTER_VARIANTS))
+        if n_users:
+            body['userId'] = rng.randrange(min(n_users, 50))
+        payloads.append(body)
+    return payloads
+
+
+def load_summary(server, limit, concurrency, samples, elapsed):
+    """Throughput and latency of one load run; samples are (seconds, status, degraded) per request."""
+    latencies = np.array([sample[0] for sample in samples]) * 1000
+    return {
+        'server': server,
+        'limit': limit,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3) if len(samples) else None,
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3) if len(samples) else None,
+        'errors': sum(1 for _, status, _ in samples if status >= 500),
+        'degraded': sum(1 for _, _, degraded in samples if degraded),
+    }
+
+
+def load_threads(request, payloads, concurrency, duration):
+    """Closed-loop load: `concurrency` threads each sending request(body) until `duration` elapses."""
+    samples = [[] for _ in range(concurrency)]
+    deadline = time.perf_counter() + duration
+
+    def client(worker):
+        i = worker
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status, degraded = request(payloads[i % len(payloads)])
+            samples[worker].append((time.perf_counter() - started, status, degraded))
+            i += concurrency
+
+    threads = [threading.Thread(target=client, args=(worker,)) for worker in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for worker in samples for sample in worker], time.perf_counter() - started
+
+
+def load_flask(flask_app, payloads, concurrency, duration):
+    """The Flask app with one thread per connection, like the threaded development server."""
+    clients = threading.local()
+
+    def request(body):
+        if not hasattr(clients, 'client'):
+            clients.client = flask_app.test_client()
+        response = clients.client.post('/api/recommendations', json=body)
+        return response.status_code, False
+
+    return load_threads(request, payloads, concurrency, duration)
+
+
+async def asgi_post(asgi_app, path, payload):
+    """POST a JSON payload to an ASGI app in process; returns (status, headers dict, body)."""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode('utf-8'), 'query_string': b'', 'root_path': '',
+        'headers': [(b'content-type', b'application/json')], 'server': ('localhost', 8000),
+        'client': ('127.0.0.1', 0),
+    }
+    messages = [{'type': 'http.request', 'body': json.dumps(payload).encode('utf-8'), 'more_body': False}]
+    response = {'body': b''}
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'], response['headers'] = message['status'], dict(message['headers'])
+        else:
+            response['body'] += message.get('body', b'')
+
+    await asgi_app(scope, receive, send)
+    return response['status'], response['headers'], response['body']
+
+
+def load_asgi(asgi_app, payloads, concurrency, duration):
+    """The ASGI app on one event loop with `concurrency` concurrent clients."""
+    async def run():
+        deadline = time.perf_counter() + duration
+        samples = []
+
+        async def client(worker):
+            i = worker
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status, headers, _ = await asgi_post(asgi_app, '/api/recommendations', payloads[i % len(payloads)])
+                samples.append((time.perf_counter() - started, status, b'x-degraded' in headers))
+                i += concurrency
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(worker) for worker in range(concurrency)))
+        return samples, time.perf_counter() - started
+
+    return asyncio.run(run())
+
+
+def load_http(url, payloads, concurrency, duration):
+    """Any running server over HTTP, one keep-alive connection per client thread."""
+    target = urllib.parse.urlsplit(url)
+    connections = threading.local()
+
+    def request(body):
+        if not hasattr(connections, 'connection'):
+            connections.connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        try:
+            connections.connection.request('POST', target.path or '/api/recommendations', json.dumps(body),
+                                           {'Content-Type': 'application/json'})
+            response = connections.connection.getresponse()
+            response.read()
+            return response.status, response.getheader('X-Degraded') is not None
+        except (OSError, http.client.HTTPException):
+            connections.connection.close()
+            del connections.connection
+            return 599, False
+
+    return load_threads(request, payloads, concurrency, duration)
+
+
+def run_load_test(catalog_dir=None, concurrency=(1, 4, 16, 64), limits=(None,), duration=5.0, servers=('flask', 'asgi'),
+                  url=None, seed=0):
+    """
+    Closed-loop load test of the Flask app and the ASGI app (or of a running server at `url`)
+    at each client concurrency. For the ASGI app, each of `limits` is tried as MAX_PENDING.
+    """
+    if catalog_dir:
+        os.environ['MODELS_DIR'] = os.path.join(catalog_dir, 'models')
+        os.environ['DATA_DIR'] = os.path.join(catalog_dir, 'data')
+    os.environ.setdefault('RECOMMENDATION_CACHE_SIZE', '0')
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if url:
+            payloads = load_payloads(0, seed=seed)
+            for clients in concurrency:
+                results.append(load_summary(url, None, clients, *load_http(url, payloads, clients, duration)))
+            return results
+
+        import app as app_module
+        import asgi
+        n_users = len(app_module.models['user_features']) if 'factor_rows' in app_module.models else 0
+        payloads = load_payloads(n_users, seed=seed)
+        for clients in concurrency:
+            if 'flask' in servers:
+                results.append(load_summary('flask', None, clients,
+                                            *load_flask(app_module.app, payloads, clients, duration)))
+            if 'asgi' in servers:
+                for limit in limits:
+                    server = asgi.RecommendationServer(max_pending=limit or asgi.MAX_PENDING)
+                    results.append(load_summary('asgi', server.max_pending, clients,
+                                                *load_asgi(server, payloads, clients, duration)))
+                    server.executor.shutdown()
+    return results
+
+
+def cmd_load(args):
+    results = run_load_test(args.dir, concurrency=args.concurrency, limits=args.limits or (None,),
+                            duration=args.duration, servers=args.servers, url=args.url, seed=args.seed)
+    print(f"{'server':<8}{'limit':>6}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'degraded':>10}{'errors':>8}")
+    for line in results:
+        limit = '' if line['limit'] is None else line['limit']
+        print(f"{line['server']:<8}{limit:>6}{line['concurrency']:>8}{line['throughput_rps']:>9,.0f}"
+              f"{line['p50_ms']:>9.2f}{line['p99_ms']:>9.2f}{line['degraded']:>10}{line['errors']:>8}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'revision': git_revision(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+# Comparison between two runs
+def compare_reports(baseline, candidate, threshold=10.0):
+    """
+    Per (path, interface) p50/p99 change in percent of the candidate run
+    against the baseline. Returns (rows, regressions), where regressions are
+    the rows whose p50 got slower by more than `threshold` percent.
+    """
+    base = {(line['path'], line['interface']): line for line in baseline['results']}
+    rows, regressions = [], []
+    for line in candidate['results']:
+        before = base.get((line['path'], line['interface']))
+        if before is None:
+            continue
+        row = {
+            'path': line['path'],
+            'interface': line['interface'],
+            'p50_ms': (before['p50_ms'], line['p50_ms']),
+            'p99_ms': (before['p99_ms'], line['p99_ms']),
+            'p50_change': 100 * (line['p50_ms'] - before['p50_ms']) / max(before['p50_ms'], 1e-9),
+            'p99_change': 100 * (line['p99_ms'] - before['p99_ms']) / max(before['p99_ms'], 1e-9),
+        }
+        rows.append(row)
+        if row['p50_change'] > threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    rows, regressions = compare_reports(baseline, candidate, args.threshold)
+
+    print(f"{baseline['revision']} -> {candidate['revision']}")
+    print(f"\n{'path':<22}{'interface':<10}{'p50 ms':>18}{'change':>9}{'p99 ms':>18}{'change':>9}")
+    for row in rows:
+        print(f"{row['path']:<22}{row['interface']:<10}"
+              f"{row['p50_ms'][0]:>8.3f} -> {row['p50_ms'][1]:<6.3f}{row['p50_change']:>+8.1f}%"
+              f"{row['p99_ms'][0]:>8.3f} -> {row['p99_ms'][1]:<6.3f}{row['p99_change']:>+8.1f}%")
+    if regressions:
+        print(f"\n{len(regressions)} path(s) more than {args.threshold:g}% slower at p50")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Movie MatchMaker recommendation paths.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help='Write a synthetic catalog with TF-IDF and factor models')
+    generate.add_argument('--movies', type=int, default=100000)
+    generate.add_argument('--users', type=int, default=1000)
+    generate.add_argument('--factors', type=int, default=30)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument('--chunk-size', type=int, default=50000)
+    generate.add_argument('--out', default=None, help='Output directory (default: bench/<movies>)')
+    generate.set_defaults(func=cmd_generate)
+
+    run = subparsers.add_parser('run', help='Measure latency, throughput and memory of every recommendation path')
+    run.add_argument('--dir', default=None, help='Catalog from `generate` (default: the repository data)')
+    run.add_argument('--requests', type=int, default=1000, help='Timed requests per path and interface')
+    run.add_argument('--warmup', type=int, default=50)
+    run.add_argument('--memory-requests', type=int, default=100,
+                     help='Requests per path replayed under tracemalloc for the peak allocation')
+    run.add_argument('--interfaces', nargs='+', choices=['http', 'direct'], default=['http', 'direct'])
+    run.add_argument('--paths', nargs='+', default=None, help="Only paths starting with these, e.g. 'mood'")
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--json', default=None, help='Write the results to this file')
+    run.set_defaults(func=cmd_run)
+
+    load = subparsers.add_parser('load', help='Closed-loop load test of the Flask and ASGI servers')
+    load.add_argument('--dir', default=None, help='Catalog from `generate` (default: the repository data)')
+    load.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64], help='Concurrent clients')
+    load.add_argument('--limits', type=int, nargs='+', default=None,
+                      help='MAX_PENDING values to try for the ASGI server (default: its configured limit)')
+    load.add_argument('--duration', type=float, default=5.0, help='Seconds per server and concurrency')
+    load.add_argument('--servers', nargs='+', choices=['flask', 'asgi'], default=['flask', 'asgi'])
+    load.add_argument('--url', default=None,
+                      help='Load a running server instead, e.g. http://localhost:8000/api/recommendations')
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--json', default=None, help='Write the results to this file')
+    load.set_defaults(func=cmd_load)
+
+    compare = subparsers.add_parser('compare', help='Compare two --json results (exits 1 on p50 regressions)')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=10.0, help='Allowed p50 slowdown in percent')
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Offline build steps for the Movie MatchMaker serving artifacts.
+
+Usage:
+    python build.py neighbors [--k 50] [--block-size 1024]
+    python build.py regions
+    python build.py personalized [--k 100] [--workers N] [--block-size B] [--scaling]
+    python build.py bundle
+    python build.py tfidf [--workers N] [--chunk-size 20000] [--max-features 2000]
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz
+
+from bundle import write_bundle
+from catalog import catalog_from_dataframe, classify_regions
+from factors import FACTOR_IDS_FILE, TOP_IDS_FILE, TOP_SCORES_FILE, top_k_scores
+from search import InvertedIndex
+from similarity import normalize_rows, top_neighbors
+from tfidf import MANIFEST_FILE as TFIDF_MANIFEST_FILE
+from tfidf import DEFAULT_PARAMS, build_tfidf, check_tfidf, file_digest, read_manifest as read_tfidf_manifest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+NEIGHBOR_IDS_FILE = 'neighbor_ids.npy'
+NEIGHBOR_SCORES_FILE = 'neighbor_scores.npy'
+
+
+# Top-K neighbor table
+def build_neighbor_table(tfidf_matrix, k=50, block_size=None, memory_budget=256 * 2**20):
+    """
+    Compute the K most similar movies for every row of the TF-IDF matrix.
+
+    Rows are compared in blocks so the dense similarity slab never exceeds
+    block_size x n_movies (by default, sized to fit `memory_budget` bytes).
+    Returns (ids, scores) where ids is int32 (N, K) padded with -1 and scores
+    is float16 (N, K), both in descending order.
+    """
+    n_movies = tfidf_matrix.shape[0]
+    k = min(k, max(n_movies - 1, 0))
+    if block_size is None:
+        block_size = max(1, memory_budget // (8 * max(n_movies, 1)))
+
+    # Normalize once so the block product below is the cosine similarity
+    norms = np.sqrt(np.asarray(tfidf_matrix.multiply(tfidf_matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = tfidf_matrix.multiply(1.0 / norms[:, None]).tocsr()
+    normalized_t = normalized.T.tocsc()
+
+    ids = np.full((n_movies, k), -1, dtype=np.int32)
+    scores = np.zeros((n_movies, k), dtype=np.float16)
+    if k == 0:
+        return ids, scores
+
+    for start in range(0, n_movies, block_size):
+        stop = min(start + block_size, n_movies)
+        ids[start:stop], scores[start:stop] = top_neighbors(normalized[start:stop], normalized_t, start, k)
+
+    return ids, scores
+
+
+def cmd_neighbors(args):
+    tfidf_path = os.path.join(args.models_dir, 'tfidf_matrix.npz')
+    print(f"Loading TF-IDF matrix from: {tfidf_path}")
+    tfidf_matrix = load_npz(tfidf_path).tocsr()
+
+    start = time.perf_counter()
+    ids, scores = build_neighbor_table(tfidf_matrix, k=args.k, block_size=args.block_size)
+    elapsed = time.perf_counter() - start
+
+    # Written next to the current table and swapped in, so a failed build never leaves a torn one
+    for file_name, array in ((NEIGHBOR_IDS_FILE, ids), (NEIGHBOR_SCORES_FILE, scores)):
+        with open(os.path.join(args.models_dir, file_name + '.tmp'), 'wb') as f:
+            np.save(f, array)
+    for file_name in (NEIGHBOR_IDS_FILE, NEIGHBOR_SCORES_FILE):
+        os.replace(os.path.join(args.models_dir, file_name + '.tmp'), os.path.join(args.models_dir, file_name))
+    print(f"Wrote {ids.shape[0]} x {ids.shape[1]} neighbor table in {elapsed:.2f}s "
+          f"({(ids.nbytes + scores.nbytes) / 1e6:.1f} MB)")
+
+
+# Regional cinema labels
+def cmd_regions(args):
+    movies_path = os.path.join(args.data_dir, 'movies2024.csv')
+    print(f"Loading movies from: {movies_path}")
+    movies_df = pd.read_csv(movies_path)
+
+    start = time.perf_counter()
+    movies_df['Region'] = classify_regions(movies_df)
+    elapsed = time.perf_counter() - start
+
+    # Write next to the original and swap it in, so readers never see a partial file
+    tmp_path = movies_path + '.tmp'
+    movies_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, movies_path)
+
+    counts = ', '.join(f"{region}: {count}" for region, count in movies_df['Region'].value_counts().items())
+    print(f"Classified {len(movies_df)} movies in {elapsed:.2f}s "
+          f"({len(movies_df) / max(elapsed, 1e-9):,.0f} movies/s) -- {counts}")
+
+
+# Precomputed personalized top-K lists
+_factor_job = {}
+
+
+def _init_factor_job(user_path, movie_path, ids_path, scores_path, k):
+    # Each worker maps the inputs and the shared results files once
+    _factor_job['users'] = np.load(user_path, mmap_mode='r')
+    _factor_job['movies'] = np.ascontiguousarray(np.load(movie_path), dtype=np.float32)
+    _factor_job['ids'] = np.load(ids_path, mmap_mode='r+')
+    _factor_job['scores'] = np.load(scores_path, mmap_mode='r+')
+    _factor_job['k'] = k
+
+
+def _score_user_block(bounds):
+    start, stop = bounds
+    users = np.asarray(_factor_job['users'][start:stop], dtype=np.float32)
+    ids, scores = top_k_scores(users, _factor_job['movies'], _factor_job['k'])
+    _factor_job['ids'][start:stop] = ids
+    _factor_job['scores'][start:stop] = scores
+    return stop - start
+
+
+def build_personalized_table(models_dir, k=100, workers=1, block_size=None, cache_budget=4 * 2**20):
+    """
+    Write the top-k movie factor rows of every user to memory-mapped .npy files.
+
+    Users are scored in blocks whose (block x movies) float32 score slab
+    fits `cache_budget` bytes, spread over `workers` processes that write
+    their rows straight into the shared results files. Returns the elapsed
+    seconds.
+    """
+    user_path = os.path.join(models_dir, 'user_features.npy')
+    movie_path = os.path.join(models_dir, 'movie_features.npy')
+    n_users = np.load(user_path, mmap_mode='r').shape[0]
+    n_movies = np.load(movie_path, mmap_mode='r').shape[0]
+    k = min(k, n_movies)
+    if block_size is None:
+        block_size = max(16, cache_budget // (4 * max(n_movies, 1)))
+
+    # Fill temporary files and swap them in, so readers never see a partial table
+    ids_path = os.path.join(models_dir, TOP_IDS_FILE + '.tmp')
+    scores_path = os.path.join(models_dir, TOP_SCORES_FILE + '.tmp')
+    np.lib.format.open_memmap(ids_path, mode='w+', dtype=np.int32, shape=(n_users, k)).flush()
+    np.lib.format.open_memmap(scores_path, mode='w+', dtype=np.float32, shape=(n_users, k)).flush()
+
+    blocks = [(start, min(start + block_size, n_users)) for start in range(0, n_users, block_size)]
+    job = (user_path, movie_path, ids_path, scores_path, k)
+    start = time.perf_counter()
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=_init_factor_job, initargs=job) as pool:
+            for _ in pool.imap_unordered(_score_user_block, blocks):
+                pass
+    else:
+        _init_factor_job(*job)
+        for block in blocks:
+            _score_user_block(block)
+        _factor_job.clear()
+    elapsed = time.perf_counter() - start
+
+    os.replace(ids_path, os.path.join(models_dir, TOP_IDS_FILE))
+    os.replace(scores_path, os.path.join(models_dir, TOP_SCORES_FILE))
+    return elapsed
+
+
+def cmd_personalized(args):
+    # Factor rows the app cannot tie to catalog movies leave personalized picks off; don't score them
+    if not os.path.isfile(os.path.join(args.models_dir, FACTOR_IDS_FILE)):
+        n_factor_rows = np.load(os.path.join(args.models_dir, 'movie_features.npy'), mmap_mode='r').shape[0]
+        n_movies = len(pd.read_csv(os.path.join(args.data_dir, 'movies2024.csv'), usecols=['MovieID']))
+        if n_factor_rows != n_movies:
+            print(f"Skipping: {n_factor_rows} movie factor rows cannot be matched to {n_movies} movies "
+                  f"without {FACTOR_IDS_FILE}")
+            return
+    n_users = np.load(os.path.join(args.models_dir, 'user_features.npy'), mmap_mode='r').shape[0]
+    max_workers = args.workers or os.cpu_count() or 1
+    worker_counts = [max_workers]
+    if args.scaling:
+        worker_counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+
+    print(f"Scoring top-{args.k} movies for {n_users} users")
+    print(f"{'workers':>8}{'seconds':>10}{'users/s':>14}")
+    for workers in worker_counts:
+        elapsed = build_personalized_table(args.models_dir, k=args.k, workers=workers,
+                                           block_size=args.block_size)
+        print(f"{workers:>8}{elapsed:>10.2f}{n_users / max(elapsed, 1e-9):>14,.0f}")
+
+
+# Memory-mapped model bundle
+def cmd_bundle(args):
+    movies_path = os.path.join(args.data_dir, 'movies2024.csv')
+    print(f"Loading movies from: {movies_path}")
+    movies_df = pd.read_csv(movies_path)
+
+    def load_pickle(file_name):
+        path = os.path.join(args.models_dir, file_name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    catalog = catalog_from_dataframe(movies_df, load_pickle('genre_mlb.pkl'))
+
+    tfidf_matrix = tfidf_digest = None
+    tfidf_path = os.path.join(args.models_dir, 'tfidf_matrix.npz')
+    if os.path.isfile(tfidf_path):
+        tfidf_matrix = load_npz(tfidf_path).tocsr()
+        tfidf_manifest = read_tfidf_manifest(args.models_dir)
+        if tfidf_manifest is not None:
+            check_tfidf(tfidf_manifest, tfidf_matrix, movies_df['MovieID'].to_numpy(dtype=np.int64),
+                        os.path.join(args.models_dir, 'tfidf_vectorizer.pkl'))
+            tfidf_digest = file_digest(os.path.join(args.models_dir, TFIDF_MANIFEST_FILE))
+        tfidf_matrix = normalize_rows(tfidf_matrix)
+
+    arrays = {}
+    if tfidf_matrix is not None:
+        arrays.update(InvertedIndex.from_matrix(tfidf_matrix).arrays())
+    for file_name in (NEIGHBOR_IDS_FILE, NEIGHBOR_SCORES_FILE, 'user_features.npy', 'movie_features.npy',
+                      FACTOR_IDS_FILE, TOP_IDS_FILE, TOP_SCORES_FILE):
+        name = file_name[:-len('.npy')]
+        path = os.path.join(args.models_dir, file_name)
+        if os.path.isfile(path):
+            arrays[name] = np.load(path)
+    if 'movie_features' in arrays:
+        # Scoring copy of the (float16) features, mapped by workers instead of converted by each
+        arrays['movie_factors'] = np.ascontiguousarray(arrays['movie_features'], dtype=np.float32)
+
+    manifest = write_bundle(args.models_dir, catalog, tfidf_matrix, arrays,
+                            vectorizer=load_pickle('tfidf_vectorizer.pkl'), tfidf_manifest_sha256=tfidf_digest)
+    print(f"Wrote bundle version {manifest['version']} with {len(manifest['arrays'])} arrays "
+          f"for {manifest['size']} movies")
+
+
+# TF-IDF vectorizer and matrix
+def cmd_tfidf(args):
+    movies_path = os.path.join(args.data_dir, 'movies2024.csv')
+    workers = args.workers or os.cpu_count() or 1
+    params = dict(DEFAULT_PARAMS, max_features=args.max_features)
+    print(f"Building TF-IDF artifacts from {movies_path} ({workers} workers, {args.chunk_size} rows per chunk)")
+
+    # The neighbor table describes the old matrix's rows
+    stale_files = [os.path.join(args.models_dir, name) for name in (NEIGHBOR_IDS_FILE, NEIGHBOR_SCORES_FILE)]
+    manifest = build_tfidf(movies_path, args.models_dir, params=params, workers=workers,
+                           chunk_size=args.chunk_size, stale_files=stale_files)
+    timings = manifest['timings']
+    elapsed = timings['count_seconds'] + timings['transform_seconds']
+    print(f"Wrote {manifest['movies']} x {manifest['vocabulary_size']} TF-IDF matrix ({manifest['nnz']} entries) "
+          f"in {elapsed:.2f}s ({manifest['movies'] / max(elapsed, 1e-9):,.0f} movies/s; "
+          f"counting {timings['count_seconds']:.2f}s, transform {timings['transform_seconds']:.2f}s)")
+    for path in manifest['removed']:
+        print(f"Removed stale {os.path.basename(path)}")
+    print("Rebuild the artifacts derived from it: neighbors and bundle")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build Movie MatchMaker serving artifacts.')
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    neighbors = subparsers.add_parser('neighbors', help='Precompute the top-K content neighbor table')
+    neighbors.add_argument('--k', type=int, default=50)
+    neighbors.add_argument('--block-size', type=int, default=None,
+                           help='Rows per similarity block (default: sized to a 256 MB slab)')
+    neighbors.set_defaults(func=cmd_neighbors)
+
+    regions = subparsers.add_parser('regions', help='Classify regional cinema into a Region column of the movie data')
+    regions.set_defaults(func=cmd_regions)
+
+    personalized = subparsers.add_parser('personalized', help='Precompute top-K movies for every user')
+    personalized.add_argument('--k', type=int, default=100)
+    personalized.add_argument('--workers', type=int, default=None, help='Processes (default: CPU count)')
+    personalized.add_argument('--block-size', type=int, default=None,
+                              help='Users per block (default: sized to a 4 MB score slab)')
+    personalized.add_argument('--scaling', action='store_true',
+                              help='Rebuild with 1, 2, 4, ... workers and report users/s for each')
+    personalized.set_defaults(func=cmd_personalized)
+
+    bundle = subparsers.add_parser('bundle', help='Compile the movie data and models into a memory-mapped bundle')
+    bundle.set_defaults(func=cmd_bundle)
+
+    tfidf = subparsers.add_parser('tfidf', help='Fit the TF-IDF vectorizer and matrix on the movie data')
+    tfidf.add_argument('--workers', type=int, default=None, help='Tokenizer processes (default: CPU count)')
+    tfidf.add_argument('--chunk-size', type=int, default=20000, help='CSV rows per chunk')
+    tfidf.add_argument('--max-features', type=int, default=DEFAULT_PARAMS['max_features'],
+                       help='Vocabulary size (most frequent terms)')
+    tfidf.set_defaults(func=cmd_tfidf)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
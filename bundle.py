@@ -0,0 +1,206 @@
+"""
+Versioned, memory-mappable model bundle.
+
+`python build.py bundle` compiles the movie CSV and the model files into one
+directory of raw .npy arrays plus a manifest.json:
+
+- fixed-width catalog columns and ranked orderings as plain arrays,
+- text columns as a UTF-8 blob plus an int64 offsets array,
+- pooled columns (genre lists) as int32 codes plus their pool of distinct values,
+- the TF-IDF matrix as its CSR data/indices/indptr arrays (float32, rows L2-normalized),
+- the neighbor table, latent features and vectorizer vocabulary/idf.
+
+`open_bundle` maps every array with mmap_mode='r', so gunicorn workers share
+the pages through the OS page cache instead of each parsing the CSV and
+unpickling models into private memory. The manifest records the digest of the
+TF-IDF manifest the bundle was compiled from, so a bundle left behind by
+`python build.py tfidf` is detected by `check_bundle_tfidf`.
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy import sparse
+
+from catalog import PooledColumn, StringColumn, object_column, split_genres
+from tfidf import MANIFEST_FILE as TFIDF_MANIFEST_FILE, file_digest
+
+BUNDLE_DIR = 'bundle'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 3
+
+
+def write_bundle(models_dir, catalog, tfidf_matrix=None, arrays=None, vectorizer=None, tfidf_manifest_sha256=None):
+    """
+    Write a new bundle and swap it in place of the current one.
+
+    `catalog` is a dict built by catalog.build_catalog; `arrays` holds any
+    other named arrays to include (neighbor table, latent features).
+    `tfidf_manifest_sha256` is the digest of the TF-IDF manifest the matrix
+    and vectorizer were checked against, if there was one.
+    """
+    version = time.strftime('%Y%m%d%H%M%S')
+    final_dir = os.path.join(models_dir, BUNDLE_DIR)
+    build_dir = f"{final_dir}.building-{os.getpid()}"
+    os.makedirs(build_dir)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'size': catalog['size'],
+        'genre_names': catalog['genre_names'],
+        'mood_bits': {mood: int(bits) for mood, bits in catalog['mood_bits'].items()},
+        'arrays': [],
+        'strings': {},
+        'pools': {},
+        'tfidf_manifest_sha256': tfidf_manifest_sha256,
+    }
+
+    def save_array(name, array):
+        np.save(os.path.join(build_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        manifest['arrays'].append(name)
+
+    def save_strings(name, values, kind='text'):
+        offsets, blob = StringColumn.encode(values)
+        save_array(f"{name}.offsets", offsets)
+        save_array(f"{name}.blob", blob)
+        manifest['strings'][name] = kind
+
+    for key, value in catalog.items():
+        if key == 'orders':
+            for name, order in value.items():
+                save_array(f"catalog.orders.{name}", order)
+        elif key == 'display_genres':
+            column = value if isinstance(value, PooledColumn) else PooledColumn.from_values(list(value), key=tuple)
+            offsets, blob = StringColumn.encode(['|'.join(genres) for genres in column.pool])
+            save_array(f"catalog.{key}.codes", column.codes)
+            save_array(f"catalog.{key}.pool_offsets", offsets)
+            save_array(f"catalog.{key}.pool_blob", blob)
+            manifest['pools'][f"catalog.{key}"] = 'genres'
+        elif isinstance(value, StringColumn):
+            save_array(f"catalog.{key}.offsets", value.offsets)
+            save_array(f"catalog.{key}.blob", value.blob)
+            manifest['strings'][f"catalog.{key}"] = 'text'
+        elif isinstance(value, np.ndarray) and value.dtype == object:
+            save_strings(f"catalog.{key}", value.tolist())
+        elif isinstance(value, np.ndarray):
+            save_array(f"catalog.{key}", value)
+
+    if tfidf_matrix is not None:
+        tfidf_matrix = sparse.csr_matrix(tfidf_matrix, dtype=np.float32)
+        for part in ('data', 'indices', 'indptr'):
+            save_array(f"tfidf_matrix.{part}", getattr(tfidf_matrix, part))
+        manifest['tfidf_shape'] = list(tfidf_matrix.shape)
+
+    for name, array in (arrays or {}).items():
+        save_array(name, array)
+
+    if vectorizer is not None:
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        save_strings('tfidf_vocabulary', terms)
+        save_array('tfidf_idf', vectorizer.idf_)
+        manifest['tfidf_params'] = {
+            key: value for key, value in vectorizer.get_params().items()
+            if isinstance(value, (str, int, float, bool, type(None), list, tuple))
+        }
+
+    with open(os.path.join(build_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap directories so a starting worker never sees a half-written bundle
+    old_dir = f"{final_dir}.old-{os.getpid()}"
+    if os.path.isdir(final_dir):
+        os.rename(final_dir, old_dir)
+    os.rename(build_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def load_vectorizer(bundle):
+    """Rebuild the fitted TF-IDF vectorizer from the bundled vocabulary and idf weights."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    manifest = bundle['manifest']
+    params = {key: tuple(value) if isinstance(value, list) else value
+              for key, value in manifest.get('tfidf_params', {}).items()}
+    vectorizer = TfidfVectorizer(**params)
+    terms = bundle['tfidf_vocabulary']
+    vectorizer.vocabulary_ = {terms[i]: i for i in range(len(terms))}
+    vectorizer.idf_ = np.asarray(bundle['tfidf_idf'])
+    return vectorizer
+
+
+def bundle_exists(models_dir):
+    return os.path.isfile(os.path.join(models_dir, BUNDLE_DIR, MANIFEST_FILE))
+
+
+def check_bundle_tfidf(models_dir):
+    """
+    Raise ValueError when the TF-IDF manifest in `models_dir` is not the one
+    the bundle was compiled from (the TF-IDF artifacts were rebuilt since).
+    """
+    tfidf_manifest_path = os.path.join(models_dir, TFIDF_MANIFEST_FILE)
+    if not os.path.isfile(tfidf_manifest_path):
+        return
+    with open(os.path.join(models_dir, BUNDLE_DIR, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('tfidf_manifest_sha256') != file_digest(tfidf_manifest_path):
+        raise ValueError('The model bundle predates the current TF-IDF artifacts; '
+                         'rebuild it with `python build.py bundle`')
+
+
+def open_bundle(models_dir, mmap_mode='r'):
+    """
+    Memory-map a bundle written by write_bundle.
+
+    Returns a dict with 'manifest', 'catalog', 'tfidf_matrix' (if bundled)
+    and every other bundled array under its own name.
+    """
+    bundle_dir = os.path.join(models_dir, BUNDLE_DIR)
+    with open(os.path.join(bundle_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} "
+                         f"(expected {FORMAT_VERSION}); rebuild with `python build.py bundle`")
+
+    arrays = {
+        name: np.load(os.path.join(bundle_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in manifest['arrays']
+    }
+
+    catalog = {
+        'size': manifest['size'],
+        'genre_names': manifest['genre_names'],
+        'mood_bits': {mood: np.uint64(bits) for mood, bits in manifest['mood_bits'].items()},
+        'orders': {},
+    }
+    for name in list(arrays):
+        if name.startswith('catalog.orders.'):
+            catalog['orders'][name[len('catalog.orders.'):]] = arrays.pop(name)
+    for name in manifest['pools']:
+        # Pools are small, so they are decoded once into Python lists
+        pool = StringColumn(arrays.pop(f"{name}.pool_offsets"), arrays.pop(f"{name}.pool_blob"), parse=split_genres)
+        pool = object_column(list(pool))
+        catalog[name[len('catalog.'):]] = PooledColumn(arrays.pop(f"{name}.codes"), pool, key=tuple)
+    for name, kind in manifest['strings'].items():
+        column = StringColumn(arrays.pop(f"{name}.offsets"), arrays.pop(f"{name}.blob"),
+                              parse=split_genres if kind == 'genres' else None,
+                              serialize='|'.join if kind == 'genres' else None)
+        if name.startswith('catalog.'):
+            catalog[name[len('catalog.'):]] = column
+        else:
+            arrays[name] = column
+    for name in list(arrays):
+        if name.startswith('catalog.'):
+            catalog[name[len('catalog.'):]] = arrays.pop(name)
+
+    bundle = {'manifest': manifest, 'catalog': catalog}
+    if 'tfidf_shape' in manifest:
+        bundle['tfidf_matrix'] = sparse.csr_matrix(
+            (arrays.pop('tfidf_matrix.data'), arrays.pop('tfidf_matrix.indices'),
+             arrays.pop('tfidf_matrix.indptr')),
+            shape=tuple(manifest['tfidf_shape']), copy=False)
+    bundle.update(arrays)
+    return bundle
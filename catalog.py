@@ -0,0 +1,569 @@
+"""
+Columnar view of the movie catalog used on the request path.
+
+The catalog is a dict of NumPy arrays aligned with the rows of `movies_df`
+(row position i describes the same movie everywhere). Request filters are
+evaluated against these arrays and combined into one boolean mask, so no
+DataFrame is copied or sliced until the final top-N rows are formatted.
+
+Columns are stored compactly, so the DataFrame itself need not be kept:
+float32/int16 numerics, int8 region codes, a uint64 genre bitmask, titles
+and overviews as one UTF-8 blob each (decoded only for the rows a response
+shows) and genre lists interned once per distinct combination.
+"""
+import bisect
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+REGIONS = ('Hollywood', 'Bollywood', 'Tollywood', 'Kollywood')
+REGION_DTYPE = pd.CategoricalDtype(REGIONS)
+
+# Keywords/patterns for regional cinemas, checked in priority order; anything
+# unmatched is Hollywood (Western cinema)
+REGION_PATTERNS = {
+    'Bollywood': ['bollywood', 'hindi', 'india', 'indian', 'mumbai', 'khan', 'kapoor', 'chopra', 'johar', 'bhatt'],
+    'Tollywood': ['telugu', 'tollywood', 'hyderabad', 'andhra', 'telangana', 'rajamouli', 'prabhas', 'allu',
+                  'chiranjeevi'],
+    'Kollywood': ['tamil', 'kollywood', 'chennai', 'rajinikanth', 'vijay', 'ajith'],
+}
+REGION_TEXT_COLUMNS = ('Title', 'Actors', 'Directors', 'Overview')
+
+# Text the TF-IDF vectorizer is applied to
+CONTENT_TEXT_COLUMNS = ('Overview', 'Genres')
+
+# timePeriod -> [start, end) release-year bounds
+TIME_PERIODS = {
+    'classic': (None, 2000),
+    'modern': (2000, 2020),
+    'recent': (2020, None),
+}
+
+HIGH_RATING = 7.0
+RATING_DECIMALS = 4  # VoteAverage precision restored from the float32 column
+POPULARITY_THRESHOLD = 30
+
+# Map moods to genres
+MOOD_GENRES = {
+    'happy': ['Comedy', 'Animation', 'Family', 'Adventure'],
+    'sad': ['Drama', 'Romance', 'Music'],
+    'excited': ['Action', 'Adventure', 'Science Fiction', 'Fantasy'],
+    'relaxed': ['Documentary', 'History', 'TV Movie'],
+    'thoughtful': ['Drama', 'History', 'Documentary', 'War'],
+    'romantic': ['Romance', 'Comedy', 'Drama'],
+    # Used for moods we don't recognize
+    'default': ['Comedy', 'Drama', 'Action'],
+}
+DEFAULT_MOOD = 'default'
+
+MAX_GENRES = 64  # One bit per genre in a uint64 mask
+ORDER_DTYPE = np.int32  # Row numbers in the ranked orderings
+GENRE_SEPARATORS = re.compile(r'\s*[|,]\s*')
+
+
+def split_genres(value):
+    """Split a delimited Genres cell ('Action|Drama' or 'Action, Drama') into names."""
+    if not isinstance(value, str):
+        return []
+    return [genre for genre in GENRE_SEPARATORS.split(value.strip()) if genre]
+
+
+def genre_vocabulary(genre_mlb=None, genre_lists=()):
+    """
+    Sorted genre names: the fitted MultiLabelBinarizer's classes, plus any
+    genre that only appears in the data.
+    """
+    names = set()
+    if genre_mlb is not None:
+        for label in genre_mlb.classes_:
+            names.update(split_genres(str(label)))
+    for genres in genre_lists:
+        names.update(genres)
+    if len(names) > MAX_GENRES:
+        raise ValueError(f"{len(names)} genres do not fit in a {MAX_GENRES}-bit genre mask")
+    return sorted(names)
+
+
+def genre_bits(genre_names, genres):
+    """uint64 mask with one bit set per known genre in `genres`."""
+    bits = np.uint64(0)
+    for genre in genres:
+        if genre in genre_names:
+            bits |= np.uint64(1) << np.uint64(genre_names.index(genre))
+    return bits
+
+
+def classify_regions(movies_df):
+    """
+    Classify every movie into a regional cinema with one scan per keyword.
+
+    Title, actors, directors and overview are joined into a single lowercase
+    buffer (one line per movie) and every keyword is located with C-level
+    substring search over the whole buffer, jumping to the next movie after a
+    hit; match offsets map back to rows through the line offsets. As with the
+    per-movie keyword loop this replaces, any keyword occurring as a
+    substring counts, and the first region in REGION_PATTERNS order wins.
+    """
+    columns = [
+        movies_df[column].fillna('').astype(str).tolist()
+        for column in REGION_TEXT_COLUMNS if column in movies_df.columns
+    ]
+    texts = [' '.join(fields).replace('\n', ' ') for fields in zip(*columns)] if columns else [''] * len(movies_df)
+    buffer = '\n'.join(texts).lower()
+    line_starts = np.concatenate([[0], np.cumsum([len(text) + 1 for text in texts])]).tolist()
+
+    # Assign lower-priority regions first so higher-priority matches overwrite them
+    codes = np.zeros(len(texts), dtype=np.int8)
+    for region in reversed(list(REGION_PATTERNS)):
+        matched = np.zeros(len(texts), dtype=bool)
+        for keyword in REGION_PATTERNS[region]:
+            matched[_rows_containing(buffer, keyword, line_starts)] = True
+        codes[matched] = REGIONS.index(region)
+
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=REGION_DTYPE), index=movies_df.index)
+
+
+def _rows_containing(buffer, keyword, line_starts):
+    """Rows (lines of `buffer`) that contain `keyword` at least once."""
+    rows = []
+    position = buffer.find(keyword)
+    while position != -1:
+        row = bisect.bisect_right(line_starts, position) - 1
+        rows.append(row)
+        position = buffer.find(keyword, line_starts[row + 1])
+    return rows
+
+
+def build_catalog(movies_df, genre_mlb=None, mood_genres=None, genre_names=None):
+    """
+    Extract the numeric and categorical columns the filters need.
+
+    Genres are parsed once into a packed uint64 bitmask per movie (bit i is
+    `genre_names[i]`, the vocabulary of the data by default), and each mood
+    in `mood_genres` is compiled to the bitmask of its genres.
+    """
+    # Genre cells repeat heavily, so each distinct cell is parsed once
+    genre_codes, genre_cells = pd.factorize(movies_df['Genres'], use_na_sentinel=False)
+    genre_pool = [split_genres(value) for value in genre_cells]
+    if genre_names is None:
+        genre_names = genre_vocabulary(genre_mlb, genre_pool)
+    year = movies_df['ReleaseYear'].to_numpy(dtype=np.float32)
+    rating = movies_df['VoteAverage'].to_numpy(dtype=np.float32)
+    catalog = {
+        'size': len(movies_df),
+        'movie_id': movies_df['MovieID'].to_numpy(dtype=np.int64),
+        'year': year,
+        'rating': rating,
+        'popularity': movies_df['Popularity'].to_numpy(dtype=np.float32),
+        'region': pd.Categorical(movies_df['Region'], dtype=REGION_DTYPE).codes.astype(np.int8),
+        'genre_names': genre_names,
+        'genre_bits': np.array([genre_bits(genre_names, genres) for genres in genre_pool],
+                               dtype=np.uint64)[genre_codes],
+        'mood_bits': {mood: genre_bits(genre_names, genres) for mood, genres in (mood_genres or {}).items()},
+    }
+
+    catalog.update(build_movie_index(catalog['movie_id']))
+
+    # Display columns for format_recommendations, pre-cast with response defaults
+    catalog.update({
+        'display_title': StringColumn.from_values(_text_column(movies_df, 'Title')),
+        'display_overview': StringColumn.from_values(_text_column(movies_df, 'Overview')),
+        'display_genres': PooledColumn(genre_codes.astype(np.int32), object_column(genre_pool), key=tuple),
+        'display_year': np.nan_to_num(year, nan=0).astype(np.int16),
+        'display_rating': np.nan_to_num(rating, nan=0.0),
+    })
+    return catalog
+
+
+MOVIE_INDEX_KEYS = ('id_to_row', 'sorted_movie_ids', 'sorted_movie_rows')
+
+
+def build_movie_index(movie_ids, max_density_factor=4):
+    """
+    MovieID -> row index arrays.
+
+    When ids are non-negative and reasonably dense, a direct-address array
+    (id_to_row[id] = row, -1 if absent) answers lookups in O(1); otherwise
+    lookups binary-search a sorted copy of the ids.
+    """
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    if len(movie_ids) == 0:
+        return {'id_to_row': np.empty(0, dtype=np.int32)}
+    if movie_ids.min() >= 0 and movie_ids.max() < max_density_factor * len(movie_ids) + 1024:
+        id_to_row = np.full(movie_ids.max() + 1, -1, dtype=np.int32)
+        id_to_row[movie_ids] = np.arange(len(movie_ids), dtype=np.int32)
+        return {'id_to_row': id_to_row}
+    order = np.argsort(movie_ids, kind='stable')
+    return {'sorted_movie_ids': movie_ids[order], 'sorted_movie_rows': order.astype(np.int32)}
+
+
+def lookup_rows(catalog, movie_ids, keep_missing=False):
+    """
+    Catalog rows for the given MovieIDs, in order; unknown ids are dropped,
+    or reported as -1 with `keep_missing` so the result stays aligned.
+    """
+    movie_ids = np.asarray(movie_ids, dtype=np.int64).ravel()
+    rows = np.full(len(movie_ids), -1, dtype=np.int64)
+    if 'id_to_row' in catalog:
+        id_to_row = catalog['id_to_row']
+        in_range = (movie_ids >= 0) & (movie_ids < len(id_to_row))
+        rows[in_range] = id_to_row[movie_ids[in_range]]
+    elif len(catalog['sorted_movie_ids']):
+        sorted_ids = catalog['sorted_movie_ids']
+        positions = np.minimum(np.searchsorted(sorted_ids, movie_ids), len(sorted_ids) - 1)
+        matched = sorted_ids[positions] == movie_ids
+        rows[matched] = catalog['sorted_movie_rows'][positions[matched]]
+    return rows if keep_missing else rows[rows >= 0]
+
+
+def catalog_from_dataframe(movies_df, genre_mlb=None):
+    """
+    Build the serving catalog, with ranked orderings, from the movie data.
+
+    Region labels are normally precomputed by `python build.py regions`;
+    data without them is classified here, once.
+    """
+    if 'Region' in movies_df.columns:
+        movies_df['Region'] = movies_df['Region'].astype(REGION_DTYPE)
+    else:
+        print("Warning: movie data has no Region column (run `python build.py regions`); classifying now...")
+        movies_df['Region'] = classify_regions(movies_df)
+
+    catalog = build_catalog(movies_df, genre_mlb, MOOD_GENRES)
+    build_orderings(catalog, ranking_scores(catalog))
+    return catalog
+
+
+# Scores the recommendation modes rank by, precomputed into global orderings.
+# They are computed in float64, and ratings (at most a few decimals, far
+# above float32 precision) are first rounded back to their decimal value, so
+# the compact columns rank exactly like the CSV values.
+def ranking_scores(catalog):
+    rating = np.round(catalog['rating'].astype(np.float64), RATING_DECIMALS)
+    popularity = catalog['popularity'].astype(np.float64)
+    year = catalog['year'].astype(np.float64)
+    return {
+        'rating': (rating,),
+        'basic': (rating, popularity),
+        # Hidden gems: rating component + popularity component
+        'hidden': ((rating - 7.0) / 3 + (1 - (popularity / 30)),),
+        'underrated': (rating / 10 * (1 - (popularity / 100)),),
+        'cult': (rating / 10 * (1 - (year / 2025)),),
+    }
+
+
+def content_text(movies_df):
+    """The document the TF-IDF vectorizer sees for each movie."""
+    text = pd.Series('', index=movies_df.index)
+    for column in CONTENT_TEXT_COLUMNS:
+        if column in movies_df.columns:
+            text = text + ' ' + movies_df[column].fillna('').astype(str)
+    return text.str.strip().tolist()
+
+
+def append_catalog(catalog, movies_df):
+    """
+    Return a new catalog with the rows of `movies_df` appended after the
+    existing ones; `catalog` itself is left untouched for in-flight readers.
+
+    Genres the catalog has not seen are added at the end of its vocabulary,
+    so the genre bits of existing rows keep their meaning, and the ranked
+    orderings are merged rather than re-sorted.
+    """
+    genre_names = list(catalog['genre_names'])
+    for value in movies_df['Genres']:
+        for genre in split_genres(value):
+            if genre not in genre_names:
+                genre_names.append(genre)
+    if len(genre_names) > MAX_GENRES:
+        raise ValueError(f"{len(genre_names)} genres do not fit in a {MAX_GENRES}-bit genre mask")
+
+    if 'Region' in movies_df.columns:
+        regions = movies_df['Region'].astype(REGION_DTYPE)
+        missing = regions.isna()
+        if missing.any():
+            # Movies sent without a Region are classified like `python build.py regions` does
+            regions[missing] = classify_regions(movies_df[missing])
+        movies_df = movies_df.assign(Region=regions)
+    else:
+        movies_df = movies_df.assign(Region=classify_regions(movies_df))
+    part = build_catalog(movies_df, mood_genres=MOOD_GENRES, genre_names=genre_names)
+
+    n_old = catalog['size']
+    combined = {
+        'size': n_old + part['size'],
+        'genre_names': genre_names,
+        'mood_bits': part['mood_bits'],
+    }
+    for key, column in catalog.items():
+        if key in combined or key not in part or key in MOVIE_INDEX_KEYS:
+            continue
+        if hasattr(column, 'append'):
+            # String and pooled columns know how to extend themselves
+            combined[key] = column.append(part[key])
+        else:
+            combined[key] = np.concatenate([np.asarray(column), part[key]])
+    combined.update(build_movie_index(combined['movie_id']))
+    combined['orders'] = merge_orderings(catalog['orders'], ranking_scores(combined), n_old)
+    return combined
+
+
+def object_column(values):
+    """1-D object array holding arbitrary Python values (e.g. lists) one per row."""
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+class StringColumn:
+    """Variable-length strings stored as one UTF-8 blob and row offsets."""
+
+    def __init__(self, offsets, blob, parse=None, serialize=None):
+        self.offsets = offsets
+        self.blob = blob
+        self.parse = parse
+        self.serialize = serialize
+
+    @classmethod
+    def from_values(cls, values, parse=None, serialize=None):
+        """Column holding `values` (parsed form when `serialize` is given)."""
+        if serialize is not None:
+            values = [serialize(value) for value in values]
+        offsets, blob = cls.encode(values)
+        return cls(offsets, blob, parse, serialize)
+
+    @staticmethod
+    def encode(values):
+        """(offsets, blob) arrays for a sequence of strings."""
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return offsets, blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        value = self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+        return self.parse(value) if self.parse is not None else value
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def take(self, rows):
+        """Decode only the requested rows, as an object array."""
+        return object_column([self[row] for row in np.asarray(rows).tolist()])
+
+    def append(self, values):
+        """New column with `values` (parsed form, e.g. genre lists) after the existing rows."""
+        if isinstance(values, StringColumn) and values.parse is self.parse:
+            offsets, blob = values.offsets, values.blob
+        else:
+            if self.serialize is not None:
+                values = [self.serialize(value) for value in values]
+            offsets, blob = StringColumn.encode(values)
+        return StringColumn(np.concatenate([self.offsets, self.offsets[-1] + offsets[1:]]),
+                            np.concatenate([self.blob, blob]), self.parse, self.serialize)
+
+
+class PooledColumn:
+    """
+    Low-cardinality values (e.g. genre lists) stored once in a pool and
+    referenced by an int32 code per row. `key` makes unhashable values
+    (lists) comparable when the pool is built or extended.
+    """
+
+    def __init__(self, codes, pool, key=None):
+        self.codes = codes
+        self.pool = pool
+        self.key = key
+
+    @classmethod
+    def from_values(cls, values, key=None):
+        codes, pool = cls._intern(values, [], {}, key)
+        return cls(codes, object_column(pool), key)
+
+    @staticmethod
+    def _intern(values, pool, index, key):
+        codes = np.empty(len(values), dtype=np.int32)
+        for row, value in enumerate(values):
+            value_key = key(value) if key is not None else value
+            code = index.get(value_key)
+            if code is None:
+                code = index[value_key] = len(pool)
+                pool.append(value)
+            codes[row] = code
+        return codes, pool
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        return self.pool[self.codes[row]]
+
+    def __iter__(self):
+        return iter(self.pool[self.codes])
+
+    def take(self, rows):
+        """Values of the requested rows, as an object array."""
+        return self.pool[self.codes.take(rows)]
+
+    def append(self, values):
+        """New column with `values` after the existing rows; only unseen values grow the pool."""
+        pool = list(self.pool)
+        index = {self.key(value) if self.key is not None else value: code for code, value in enumerate(pool)}
+        codes, pool = self._intern(list(values), pool, index, self.key)
+        return PooledColumn(np.concatenate([np.asarray(self.codes), codes]), object_column(pool), self.key)
+
+
+def _text_column(movies_df, column):
+    """Values of a text column with missing values as empty strings."""
+    if column not in movies_df.columns:
+        return [''] * len(movies_df)
+    return movies_df[column].fillna('').astype(str).tolist()
+
+
+# Region code -> name; unclassified rows (code -1) display as Hollywood
+REGION_NAMES = np.array(REGIONS + ('Hollywood',), dtype=object)
+
+
+def region_mask(catalog, region):
+    """Rows classified as the given regional cinema."""
+    if region not in REGIONS:
+        return np.zeros(catalog['size'], dtype=bool)
+    return catalog['region'] == REGIONS.index(region)
+
+
+def genre_mask(catalog, genres):
+    """Rows tagged with any of the given genres (exact genre names, not substrings)."""
+    return bits_mask(catalog, genre_bits(catalog['genre_names'], genres))
+
+
+def bits_mask(catalog, bits):
+    """Rows sharing at least one genre bit with a precompiled genre bitmask."""
+    return (catalog['genre_bits'] & bits) != 0
+
+
+def filter_mask(catalog, time_period='any', rating='any-rating', popularity='any', genres=None, rows=None,
+                observe=None):
+    """
+    Compose the request filters into a single boolean mask over the catalog.
+
+    With `rows`, the filters are evaluated for those rows only and the mask
+    is aligned with `rows` (used to filter posting lists during search).
+    `observe(filter_name, seconds)` is called for each filter applied.
+    """
+    def column(name):
+        return catalog[name] if rows is None else catalog[name][rows]
+
+    mask = np.ones(catalog['size'] if rows is None else len(rows), dtype=bool)
+    started = time.perf_counter() if observe is not None else 0.0
+
+    def applied(name):
+        nonlocal started
+        if observe is not None:
+            now = time.perf_counter()
+            observe(name, now - started)
+            started = now
+
+    # Apply time period filter
+    if time_period in TIME_PERIODS:
+        start, end = TIME_PERIODS[time_period]
+        if start is not None:
+            mask &= column('year') >= start
+        if end is not None:
+            mask &= column('year') < end
+        applied('time_period')
+
+    # Apply rating filter
+    if rating == 'high-rated':
+        mask &= column('rating') >= HIGH_RATING
+        applied('rating')
+
+    # Apply popularity filter
+    if popularity == 'popular':
+        mask &= column('popularity') > POPULARITY_THRESHOLD
+        applied('popularity')
+    elif popularity == 'lesser-known':
+        mask &= column('popularity') <= POPULARITY_THRESHOLD
+        applied('popularity')
+
+    # Apply genre filter if it's not 'any'
+    if genres and 'any' not in genres:
+        mask &= (column('genre_bits') & genre_bits(catalog['genre_names'], genres)) != 0
+        applied('genre')
+
+    return mask
+
+
+def build_orderings(catalog, ranking_scores):
+    """
+    Precompute a global ranking of all catalog rows for each named score.
+
+    `ranking_scores` maps a name to a tuple of full-catalog score arrays, most
+    significant first. Rows are ordered by descending score with NaN last and
+    ties kept in catalog order, as with a stable DataFrame.sort_values.
+    """
+    catalog['orders'] = {
+        name: np.lexsort(tuple(-key for key in reversed(keys))).astype(ORDER_DTYPE)
+        for name, keys in ranking_scores.items()
+    }
+
+
+def merge_orderings(orders, ranking_scores, n_old):
+    """
+    Insert rows n_old.. into orderings built over the first n_old rows.
+
+    `ranking_scores` covers all rows. The result equals build_orderings over
+    the full catalog: new rows land after every existing row they tie with,
+    and each order is extended with one binary search per new row and key.
+    """
+    merged = {}
+    for name, keys in ranking_scores.items():
+        order = orders[name]
+        n_total = len(keys[0])
+        new_rows = np.arange(n_old, n_total)
+        new_rows = new_rows[np.lexsort(tuple(-key[new_rows] for key in reversed(keys)))]
+
+        # Narrow each new row's insertion point one key at a time
+        low = np.zeros(len(new_rows), dtype=np.int64)
+        high = np.full(len(new_rows), len(order), dtype=np.int64)
+        for level, key in enumerate(keys):
+            sorted_key = -key[order]
+            values = -key[new_rows]
+            if level == 0:
+                low = np.searchsorted(sorted_key, values, side='left')
+                high = np.searchsorted(sorted_key, values, side='right')
+                continue
+            for i in np.flatnonzero(high > low):
+                segment = sorted_key[low[i]:high[i]]
+                low[i], high[i] = (low[i] + np.searchsorted(segment, values[i], side='left'),
+                                   low[i] + np.searchsorted(segment, values[i], side='right'))
+        merged[name] = np.insert(np.asarray(order, dtype=ORDER_DTYPE), high, new_rows)
+    return merged
+
+
+def first_rows(order, mask, n=6, chunk_size=1024):
+    """
+    Walk a precomputed ordering and return the first n rows that pass `mask`.
+
+    The ordering is scanned in growing chunks, so a selective filter only
+    touches as much of the ranking as it needs.
+    """
+    if order is None:
+        return np.flatnonzero(mask)[:n]
+    found = []
+    remaining = n
+    start = 0
+    while remaining > 0 and start < len(order):
+        rows = order[start:start + chunk_size]
+        rows = rows[mask[rows]][:remaining]
+        found.append(rows)
+        remaining -= len(rows)
+        start += chunk_size
+        chunk_size *= 2
+    return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
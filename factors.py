@@ -0,0 +1,70 @@
+"""
+Collaborative-filtering scores from the latent factor models.
+
+`user_features.npy` (users x factors) and `movie_features.npy` (movies x
+factors) score a user against a movie with a dot product. Factor rows are
+tied to catalog rows through `movie_feature_ids.npy` (the MovieID of each
+factor row) when it is present, and otherwise positionally, which only
+holds when there are exactly as many factor rows as catalog movies.
+
+Scores are computed in float32 as one BLAS matrix product per block of
+users, and the top K are selected with argpartition, so nothing is sorted
+beyond the K rows that are returned.
+"""
+import os
+
+import numpy as np
+
+from catalog import lookup_rows
+
+FACTOR_IDS_FILE = 'movie_feature_ids.npy'
+TOP_IDS_FILE = 'personalized_ids.npy'
+TOP_SCORES_FILE = 'personalized_scores.npy'
+
+
+def factor_catalog_rows(catalog, n_factors, factor_ids=None):
+    """
+    Catalog row of every movie factor row (-1 where the movie is not in the
+    catalog). Without factor_ids, raise ValueError unless the counts match.
+    """
+    if factor_ids is not None:
+        return lookup_rows(catalog, factor_ids, keep_missing=True)
+    if n_factors != catalog['size']:
+        raise ValueError(f"{n_factors} movie factor rows cannot be matched to {catalog['size']} catalog movies "
+                         f"without {FACTOR_IDS_FILE}")
+    return np.arange(n_factors, dtype=np.int64)
+
+
+def top_k_scores(user_vectors, movie_factors, k, allowed=None):
+    """
+    Top-k factor rows for each user vector, best first.
+
+    `user_vectors` is (users x factors) and `movie_factors` (movies x factors),
+    both float32. `allowed` optionally masks factor rows, either one mask for
+    all users or one row per user. Returns int32 (users, k) rows padded with
+    -1 and float32 (users, k) scores.
+    """
+    scores = user_vectors @ movie_factors.T
+    if allowed is not None:
+        scores = np.where(allowed, scores, -np.inf)
+
+    n_users, n_movies = scores.shape
+    k = min(k, n_movies)
+    ids = np.full((n_users, k), -1, dtype=np.int32)
+    top_scores = np.full((n_users, k), -np.inf, dtype=np.float32)
+    if k == 0:
+        return ids, top_scores
+
+    top = np.argpartition(scores, n_movies - k, axis=1)[:, n_movies - k:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    # Equal scores (common with float16 factors) are ordered by row
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    ids[:] = np.where(np.isfinite(top_scores), top, -1)
+    return ids, top_scores.astype(np.float32)
+
+
+def load_factor_ids(models_dir):
+    path = os.path.join(models_dir, FACTOR_IDS_FILE)
+    return np.load(path) if os.path.isfile(path) else None
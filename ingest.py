@@ -0,0 +1,173 @@
+"""
+Append new movies to a loaded model snapshot without a rebuild or restart.
+
+`append_movies` never modifies the snapshot it is given: it returns a new
+models dict whose changed entries (catalog columns and orderings, TF-IDF
+rows, similarity and search indexes, neighbor lists) are extended copies and
+whose other entries are shared. The app swaps the new dict in with a single
+assignment, so requests already running keep reading the old snapshot.
+
+- New TF-IDF rows come from the fitted vectorizer (no refit: the vocabulary
+  and idf weights stay those of the offline build).
+- Neighbor lists are computed for the new movies, and existing movies only
+  take a new movie in when it beats their current K-th neighbor.
+
+Ingested movies live in memory only; rebuild the artifacts offline
+(`python build.py ...`) to make them permanent.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from catalog import REGIONS, append_catalog, content_text, lookup_rows
+from similarity import normalize_rows, top_neighbors
+
+REQUIRED_COLUMNS = ('MovieID', 'Title')
+TEXT_COLUMNS = ('Title', 'Genres', 'Overview', 'Actors', 'Directors')
+NUMERIC_COLUMNS = ('ReleaseYear', 'VoteAverage', 'Popularity')
+
+# Accepted [low, high] ranges of the numeric columns (missing values are allowed)
+NUMERIC_BOUNDS = {
+    'ReleaseYear': (1870, 2100),
+    'VoteAverage': (0, 10),
+    'Popularity': (0, np.finfo(np.float32).max),
+}
+
+
+def movies_frame(records):
+    """
+    DataFrame for a list of movie records keyed like the CSV columns
+    (MovieID, Title, Genres, ReleaseYear, VoteAverage, Popularity, Overview,
+    Actors, Directors, optional Region; movies without one are classified
+    when appended). Raises ValueError if invalid, e.g. for a year outside
+    NUMERIC_BOUNDS or a Region not in REGIONS.
+    """
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ValueError('Expected a list of movie objects')
+    movies_df = pd.DataFrame.from_records(records)
+    for column in REQUIRED_COLUMNS:
+        if column not in movies_df.columns or movies_df[column].isna().any():
+            raise ValueError(f"Every movie needs a {column}")
+    movie_ids = pd.to_numeric(movies_df['MovieID'], errors='coerce')
+    if movie_ids.isna().any() or (movie_ids % 1 != 0).any():
+        raise ValueError('MovieID must be an integer')
+    # Checked before the cast, which would wrap out-of-range ids (floats are exact only up to 2**63)
+    too_large = movie_ids >= 2.0 ** 63 if movie_ids.dtype.kind == 'f' else movie_ids > np.iinfo(np.int64).max
+    if (movie_ids < 1).any() or too_large.any():
+        raise ValueError(f"MovieID must be between 1 and {np.iinfo(np.int64).max}")
+    movies_df['MovieID'] = movie_ids.astype(np.int64)
+
+    for column in TEXT_COLUMNS:
+        movies_df[column] = movies_df[column].fillna('').astype(str) if column in movies_df.columns else ''
+    for column in NUMERIC_COLUMNS:
+        values = movies_df[column] if column in movies_df.columns else np.nan
+        movies_df[column] = pd.to_numeric(values, errors='coerce')
+        low, high = NUMERIC_BOUNDS[column]
+        if ((movies_df[column] < low) | (movies_df[column] > high)).any():
+            raise ValueError(f"{column} must be between {low:g} and {high:g}")
+    if 'Region' in movies_df.columns:
+        regions = movies_df['Region'].dropna()
+        if not regions.isin(REGIONS).all():
+            raise ValueError(f"Region must be one of {', '.join(REGIONS)}")
+    return movies_df
+
+
+def extend_neighbor_table(ids, scores, vectors, n_old, memory_budget=64 * 2**20):
+    """
+    Neighbor table for `vectors` (rows n_old.. are new) from the table of
+    the first n_old rows, without recomputing it.
+
+    Returns new (ids, scores) arrays; the given ones are not modified.
+    """
+    n_total, k = vectors.shape[0], ids.shape[1]
+    n_new = n_total - n_old
+    new_ids = np.full((n_total, k), -1, dtype=ids.dtype)
+    new_scores = np.zeros((n_total, k), dtype=scores.dtype)
+    new_ids[:n_old], new_scores[:n_old] = ids, scores
+    if n_new == 0 or k == 0:
+        return new_ids, new_scores
+
+    # Neighbors of the new movies, against every movie
+    vectors_t = vectors.T.tocsc()
+    top_k = min(k, n_total - 1)
+    block_size = max(1, memory_budget // (8 * n_total))
+    for start in range(n_old, n_total, block_size):
+        stop = min(start + block_size, n_total)
+        new_ids[start:stop, :top_k], new_scores[start:stop, :top_k] = top_neighbors(
+            vectors[start:stop], vectors_t, start, top_k)
+
+    # Existing movies only change where a new movie beats their K-th neighbor.
+    # Stored scores may be float16, so current neighbors are rescored exactly
+    # before they are compared with the new movies.
+    added_t = vectors[n_old:].T.tocsc()
+    added_rows = np.arange(n_old, n_total, dtype=ids.dtype)
+    block_size = max(1, memory_budget // (8 * n_new))
+    for start in range(0, n_old, block_size):
+        stop = min(start + block_size, n_old)
+        sims = (vectors[start:stop] @ added_t).toarray()
+        worst = _pair_scores(vectors, np.arange(start, stop), new_ids[start:stop, -1:])[:, 0]
+        changed = np.flatnonzero(sims.max(axis=1) > worst)
+        if len(changed) == 0:
+            continue
+        rows = start + changed
+        candidate_ids = np.hstack([new_ids[rows], np.broadcast_to(added_rows, (len(rows), n_new))])
+        candidate_scores = np.hstack([_pair_scores(vectors, rows, new_ids[rows]), sims[changed]])
+        top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(candidate_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        new_ids[rows] = np.where(np.isfinite(top_scores), np.take_along_axis(candidate_ids, top, axis=1), -1)
+        new_scores[rows] = np.where(np.isfinite(top_scores), top_scores, 0)
+    return new_ids, new_scores
+
+
+def _pair_scores(vectors, rows, neighbor_ids):
+    """Exact similarity of each row to each of its listed neighbors (-inf for -1 padding)."""
+    n_rows, k = neighbor_ids.shape
+    valid = neighbor_ids >= 0
+    left = vectors[np.repeat(rows, k)]
+    right = vectors[np.where(valid, neighbor_ids, 0).ravel()]
+    scores = np.asarray(left.multiply(right).sum(axis=1)).reshape(n_rows, k)
+    return np.where(valid, scores, -np.inf)
+
+
+def append_movies(models, movies_df):
+    """
+    Return (snapshot, added_ids, skipped_ids): a new models dict with the
+    movies of `movies_df` appended. Movies whose MovieID is already in the
+    catalog (or repeated in the batch) are skipped.
+    """
+    catalog = models['catalog']
+    engine = models.get('similarity_engine')
+    if engine is not None and 'tfidf' not in models:
+        raise ValueError('The TF-IDF vectorizer is not loaded, so new movies cannot be indexed')
+
+    movie_ids = movies_df['MovieID'].to_numpy(dtype=np.int64)
+    skip = (lookup_rows(catalog, movie_ids, keep_missing=True) >= 0) | movies_df['MovieID'].duplicated().to_numpy()
+    skipped_ids = movie_ids[skip].tolist()
+    movies_df = movies_df[~skip].reset_index(drop=True)
+    if len(movies_df) == 0:
+        return models, [], skipped_ids
+
+    n_old = catalog['size']
+    snapshot = dict(models)
+    snapshot['catalog'] = append_catalog(catalog, movies_df)
+
+    if engine is not None:
+        added = normalize_rows(models['tfidf'].transform(content_text(movies_df)), dtype=engine.vectors.dtype)
+        vectors = sparse.vstack([engine.vectors, added], format='csr')
+        snapshot['similarity_engine'] = engine.add(vectors, n_old)
+        # Rows of the combined matrix are L2-normalized, like a bundled one
+        snapshot['tfidf_matrix'] = vectors
+        if 'search_index' in models:
+            snapshot['search_index'] = models['search_index'].append(added, n_old)
+        if 'neighbor_ids' in models:
+            snapshot['neighbor_ids'], snapshot['neighbor_scores'] = extend_neighbor_table(
+                models['neighbor_ids'], models['neighbor_scores'], vectors, n_old)
+
+    if 'catalog_factor_rows' in models:
+        # New movies have no latent factors until the factor model is retrained
+        snapshot['catalog_factor_rows'] = np.concatenate(
+            [models['catalog_factor_rows'], np.full(len(movies_df), -1, dtype=models['catalog_factor_rows'].dtype)])
+
+    return snapshot, movies_df['MovieID'].tolist(), skipped_ids
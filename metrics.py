@@ -0,0 +1,285 @@
+"""
+Lightweight in-process metrics rendered in the Prometheus text format.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock,
+so recording a value costs about a microsecond and needs no client library.
+Label values are resolved to a child series once (`metric.labels(...)`) and
+can be kept by the caller for the hot path.
+
+RequestProfiler is an opt-in sampling hook: a sampled request runs under
+cProfile, and its profile is kept only if the request turned out to be slow.
+"""
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        # Raw label values (e.g. an int status) -> child, so repeated lookups skip str()
+        self._lookup = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, **labels):
+        """The series for one combination of label values (created on first use)."""
+        raw_key = tuple([labels[name] for name in self.labelnames])
+        child = self._lookup.get(raw_key)
+        if child is None:
+            key = tuple([str(value) for value in raw_key])
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+                self._lookup[raw_key] = child
+        return child
+
+    def _series(self):
+        for key, child in sorted(self._children.items()):
+            yield dict(zip(self.labelnames, key)), child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in self._series():
+            lines.extend(child.render(self.name, labels))
+        return lines
+
+
+class _Value:
+    def __init__(self, registry):
+        self.registry = registry
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def render(self, name, labels, suffix=''):
+        return [f"{name}{suffix}{_format_labels(labels)} {_format_value(self.value)}"]
+
+
+class _CounterValue(_Value):
+    def inc(self, amount=1):
+        if self.registry.enabled:
+            with self._lock:
+                self.value += amount
+
+    def render(self, name, labels):
+        return super().render(name, labels, suffix='_total')
+
+
+class _GaugeValue(_Value):
+    def set(self, value):
+        self.value = float(value)
+
+    def time(self):
+        """Context manager setting the gauge to the duration of its block, in seconds."""
+        return _Timer(self.set)
+
+
+class _HistogramValue:
+    def __init__(self, registry, buckets):
+        self.registry = registry
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block, in seconds."""
+        return _Timer(self.observe)
+
+    def summary(self):
+        """(count, sum, p50, p99), the quantiles estimated from the buckets (None before any observation)."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        quantiles = [_bucket_quantile(self.buckets, counts, q) for q in (0.5, 0.99)]
+        return (sum(counts), total) + tuple(quantiles)
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+def _bucket_quantile(buckets, counts, q):
+    """
+    Interpolate the q-quantile within the bucket holding it, as Prometheus'
+    histogram_quantile does; values past the last bound report that bound.
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            if index == len(buckets):
+                return buckets[-1]
+            lower = buckets[index - 1] if index > 0 else 0.0
+            return lower + (buckets[index] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+class _Timer:
+    __slots__ = ('record', 'start')
+
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record(time.perf_counter() - self.start)
+        return False
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterValue(self.registry)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue(self.registry)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.registry, self.buckets)
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together. `collectors` are callables
+    returning extra exposition lines at scrape time (e.g. cache counters).
+    When `enabled` is false, recording is a no-op.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return Counter(self, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return Gauge(self, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return Histogram(self, name, help_text, labelnames, buckets)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """
+    Profile a random `sample_rate` fraction of requests with cProfile and keep
+    the profiles of those slower than `threshold_ms`: the top functions are
+    printed and, with `output_dir`, the raw stats are saved as a .prof file.
+    Only one request is profiled at a time.
+    """
+
+    def __init__(self, sample_rate=0.0, threshold_ms=250.0, output_dir=None, top=15):
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.output_dir = output_dir
+        self.top = top
+        self._busy = threading.Lock()
+        self.profiled = 0
+        self.kept = 0
+
+    def start(self):
+        """A running profiler for this request, or None if it is not sampled."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this interpreter
+            self._busy.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, elapsed_ms, label):
+        profiler.disable()
+        self._busy.release()
+        self.profiled += 1
+        if elapsed_ms < self.threshold_ms:
+            return
+        self.kept += 1
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(self.top)
+        print(f"Slow request {label} took {elapsed_ms:.1f} ms:\n{summary.getvalue()}")
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                                              f"{self.kept}.prof"))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,106 @@
+"""
+Second-stage re-ranking of a few hundred candidate movies.
+
+Candidate generation (similarity search, factor scoring or a filter walk)
+stays cheap and single-criterion; this stage blends several signals over
+the candidate set with configurable weights:
+
+- similarity: content similarity to the reference/seed movies,
+- factor: the user's latent factor score,
+- rating, popularity (log-scaled) and recency (release year).
+
+Each signal is min-max scaled over the candidates, so weights are relative
+and signals a request doesn't have (e.g. no userId) simply contribute zero.
+The final list is picked with maximal marginal relevance (MMR), trading
+relevance against TF-IDF similarity to the movies already picked.
+"""
+import numpy as np
+
+SIGNALS = ('similarity', 'factor', 'rating', 'popularity', 'recency')
+DEFAULT_WEIGHTS = {
+    'similarity': 0.4,
+    'factor': 0.2,
+    'rating': 0.2,
+    'popularity': 0.1,
+    'recency': 0.1,
+}
+DEFAULT_DIVERSITY = 0.2
+
+
+def parse_rerank_options(value):
+    """
+    Normalize the `rerank` field of a request: true for the defaults, or an
+    object overriding some weights and/or `diversity`. Returns None when
+    re-ranking was not requested.
+    """
+    if value is True:
+        value = {}
+    if not isinstance(value, dict):
+        return None
+    options = dict(DEFAULT_WEIGHTS, diversity=DEFAULT_DIVERSITY)
+    for name in options:
+        weight = value.get(name)
+        if isinstance(weight, (int, float)) and not isinstance(weight, bool) and np.isfinite(weight):
+            options[name] = float(weight)
+    options['diversity'] = min(max(options['diversity'], 0.0), 1.0)
+    return options
+
+
+def candidate_signals(catalog, rows, similarity=None, factor=None):
+    """Raw signals for candidate catalog rows; `similarity`/`factor` are aligned with `rows`."""
+    return {
+        'similarity': similarity,
+        'factor': factor,
+        'rating': catalog['rating'][rows],
+        'popularity': np.log1p(np.maximum(catalog['popularity'][rows], 0)),
+        'recency': catalog['year'][rows],
+    }
+
+
+def blend_scores(signals, weights, n_candidates):
+    """Weighted sum of min-max scaled signals (missing or constant signals add nothing)."""
+    relevance = np.zeros(n_candidates, dtype=np.float64)
+    for name in SIGNALS:
+        values, weight = signals.get(name), weights.get(name, 0.0)
+        if values is None or weight == 0:
+            continue
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values)
+        if not finite.any():
+            continue
+        low, high = values[finite].min(), values[finite].max()
+        if high > low:
+            relevance += weight * np.where(finite, (values - low) / (high - low), 0.0)
+    return relevance
+
+
+def mmr_order(relevance, vectors, n, diversity):
+    """
+    Greedy maximal marginal relevance: repeatedly pick the candidate with the
+    best (1 - diversity) * relevance - diversity * (max similarity to the
+    picks so far). `vectors` are the candidates' L2-normalized rows.
+    """
+    n = min(n, len(relevance))
+    if diversity <= 0 or vectors is None or n == 0:
+        return np.argsort(-relevance, kind='stable')[:n]
+
+    similarity = vectors @ vectors.T
+    similarity = similarity.toarray() if hasattr(similarity, 'toarray') else np.asarray(similarity)
+    closest = np.zeros(len(relevance))
+    available = np.ones(len(relevance), dtype=bool)
+    picked = []
+    for _ in range(n):
+        marginal = np.where(available, (1 - diversity) * relevance - diversity * closest, -np.inf)
+        best = int(np.argmax(marginal))
+        picked.append(best)
+        available[best] = False
+        np.maximum(closest, similarity[best], out=closest)
+    return np.asarray(picked, dtype=np.int64)
+
+
+def rerank(rows, signals, options, n=6, vectors=None):
+    """Re-rank candidate rows and return the top n, best first."""
+    rows = np.asarray(rows, dtype=np.int64)
+    relevance = blend_scores(signals, options, len(rows))
+    candidate_vectors = vectors[rows] if vectors is not None and len(rows) else None
+    return rows[mmr_order(relevance, candidate_vectors, n, options.get('diversity', 0.0))]
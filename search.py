@@ -0,0 +1,135 @@
+"""
+Free-text search over the TF-IDF matrix through an inverted index.
+
+The index is the column-major (CSC) view of the row-normalized TF-IDF matrix:
+for every term, the rows containing it (ascending) and their weights, plus the
+term's largest weight. Queries are scored term-at-a-time with MaxScore
+pruning: once the k-th best score so far beats everything the remaining terms
+could still add, those terms only update movies already in the running, so
+query cost follows the postings that can matter rather than catalog size.
+"""
+import numpy as np
+from scipy import sparse
+
+
+class InvertedIndex:
+    """Term -> (rows, weights) posting lists with per-term upper bounds."""
+
+    def __init__(self, offsets, rows, weights, max_weights):
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.max_weights = max_weights
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Build posting lists from a (rows x terms) sparse matrix."""
+        by_term = sparse.csc_matrix(matrix)
+        by_term.sort_indices()
+        max_weights = np.zeros(by_term.shape[1], dtype=np.float32)
+        lengths = np.diff(by_term.indptr)
+        nonempty = lengths > 0
+        if by_term.nnz:
+            max_weights[nonempty] = np.maximum.reduceat(by_term.data, by_term.indptr[:-1][nonempty])
+        return cls(by_term.indptr.astype(np.int64), by_term.indices.astype(np.int32),
+                   by_term.data.astype(np.float32), max_weights)
+
+    def arrays(self):
+        """Named arrays for storing the index in the model bundle."""
+        return {
+            'postings_offsets': self.offsets,
+            'postings_rows': self.rows,
+            'postings_weights': self.weights,
+            'postings_max_weights': self.max_weights,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['postings_offsets'], arrays['postings_rows'],
+                   arrays['postings_weights'], arrays['postings_max_weights'])
+
+    def append(self, matrix, n_old):
+        """
+        New index with the rows of `matrix` added as rows n_old.. after the
+        indexed ones.
+
+        Appended rows have the largest row numbers, so they go at the end of
+        each term's posting list and every list stays ascending.
+        """
+        added = InvertedIndex.from_matrix(matrix)
+        old_lengths, new_lengths = np.diff(self.offsets), np.diff(added.offsets)
+        offsets = np.concatenate([[0], np.cumsum(old_lengths + new_lengths)]).astype(np.int64)
+
+        # Old postings shift right by the new postings of earlier terms, and vice versa
+        old_terms = np.repeat(np.arange(len(old_lengths)), old_lengths)
+        new_terms = np.repeat(np.arange(len(new_lengths)), new_lengths)
+        old_positions = np.arange(len(self.rows)) + added.offsets[old_terms]
+        new_positions = np.arange(len(added.rows)) + self.offsets[new_terms + 1]
+
+        rows = np.empty(offsets[-1], dtype=np.int32)
+        weights = np.empty(offsets[-1], dtype=np.float32)
+        rows[old_positions], weights[old_positions] = self.rows, self.weights
+        rows[new_positions], weights[new_positions] = added.rows + n_old, added.weights
+        return InvertedIndex(offsets, rows, weights, np.maximum(self.max_weights, added.max_weights))
+
+    def postings(self, term, accept=None):
+        start, stop = self.offsets[term], self.offsets[term + 1]
+        rows, weights = self.rows[start:stop], self.weights[start:stop]
+        if accept is not None and len(rows):
+            keep = accept(rows)
+            rows, weights = rows[keep], weights[keep]
+        return rows, weights
+
+    def search(self, query, k=6, accept=None):
+        """
+        Top-k rows for a (1 x terms) sparse query vector, best first.
+
+        `accept(rows) -> bool array` filters postings as they are read, so
+        filtered-out movies never enter the accumulator.
+        """
+        query = sparse.csr_matrix(query)
+        terms, query_weights = query.indices, query.data.astype(np.float32)
+        if len(terms) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Visit high-impact terms first; remaining[i] bounds what terms i.. can add
+        bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        terms, query_weights, bounds = terms[order], query_weights[order], bounds[order]
+        remaining = np.cumsum(bounds[::-1])[::-1]
+
+        candidates = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float32)
+        for i, (term, query_weight) in enumerate(zip(terms, query_weights)):
+            threshold = _kth_largest(scores, k)
+            if threshold >= remaining[i]:
+                # No unseen movie can reach the top k any more: only update candidates,
+                # and drop those that cannot catch up with the current k-th score
+                keep = scores + remaining[i] >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+                rows, weights = self.postings(term)
+                positions = np.searchsorted(rows, candidates)
+                positions[positions == len(rows)] = 0
+                matched = (rows[positions] == candidates) if len(rows) else np.zeros(len(candidates), dtype=bool)
+                scores[matched] += query_weight * weights[positions[matched]]
+                continue
+
+            rows, weights = self.postings(term, accept)
+            merged = np.union1d(candidates, rows)
+            merged_scores = np.zeros(len(merged), dtype=np.float32)
+            merged_scores[np.searchsorted(merged, candidates)] = scores
+            merged_scores[np.searchsorted(merged, rows)] += query_weight * weights
+            candidates, scores = merged, merged_scores
+
+        k = min(k, len(candidates))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return candidates[top], scores[top]
+
+
+def _kth_largest(scores, k):
+    if len(scores) < k:
+        return -np.inf
+    return np.partition(scores, len(scores) - k)[len(scores) - k]
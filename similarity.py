@@ -0,0 +1,96 @@
+"""
+Similarity engine for content recommendations.
+
+BruteForceEngine answers "which rows are most similar to this query
+vector?" exactly, over a matrix of L2-normalized rows (the TF-IDF matrix).
+Content requests for catalog movies are served from the precomputed neighbor
+table (`python build.py neighbors`); the engine scores the rest, such as
+movies ingested since the table was built.
+"""
+import numpy as np
+from scipy import sparse
+
+
+def normalize_rows(vectors, dtype=None):
+    """
+    L2-normalize the rows of a sparse or dense matrix (zero rows are left as
+    is). Sparse rows are cast to `dtype` if given (float32 when serving).
+    """
+    if sparse.issparse(vectors):
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.csr_matrix(vectors.multiply(1.0 / norms[:, None]), dtype=dtype)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, None]
+
+
+def _dense_scores(vectors, query):
+    """Dot products between the rows of `vectors` and a single query vector."""
+    if sparse.issparse(query):
+        query = query.toarray()
+    query = np.asarray(query, dtype=np.float32).ravel()
+    return np.asarray(vectors @ query).ravel()
+
+
+def _top_k(rows, scores, k, exclude=None):
+    """Pick the k best (rows, scores) pairs, best first, skipping excluded rows."""
+    if exclude is not None and len(rows):
+        keep = ~np.isin(rows, exclude)
+        rows, scores = rows[keep], scores[keep]
+    k = min(k, len(rows))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return rows[top], scores[top]
+
+
+def top_neighbors(block, vectors_t, first_row, k):
+    """
+    Top-k most similar rows for a block of consecutive rows starting at
+    `first_row`, scored against `vectors_t` (the transposed, normalized rows)
+    and never listing a row as its own neighbor. Returns (ids, scores),
+    best first.
+    """
+    sims = block @ vectors_t
+    sims = sims.toarray() if sparse.issparse(sims) else np.asarray(sims)
+    n_block = sims.shape[0]
+    sims[np.arange(n_block), np.arange(first_row, first_row + n_block)] = -np.inf
+
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(sims, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class SimilarityEngine:
+    """Common interface: search(query, k, exclude) -> (rows, scores), best first."""
+    name = 'base'
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def search(self, query, k=20, exclude=None):
+        raise NotImplementedError
+
+    def search_row(self, row, k=20):
+        """Find the k rows most similar to an existing row, excluding the row itself."""
+        return self.search(self.vectors[row], k=k, exclude=[row])
+
+    def add(self, vectors, n_old):
+        """
+        New engine over `vectors`, whose rows n_old.. were appended to the
+        rows this one indexes. The current engine is left unchanged.
+        """
+        return type(self)(vectors)
+
+
+class BruteForceEngine(SimilarityEngine):
+    """Exact cosine search over every row."""
+    name = 'exact'
+
+    def search(self, query, k=20, exclude=None):
+        scores = _dense_scores(self.vectors, query)
+        return _top_k(np.arange(len(scores)), scores, k, exclude)
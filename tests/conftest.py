@@ -0,0 +1,41 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def catalog_dir(tmp_path_factory):
+    """A small synthetic catalog from `benchmark.py generate`, with factors for every movie."""
+    from benchmark import generate_catalog
+
+    out_dir = str(tmp_path_factory.mktemp('catalog'))
+    generate_catalog(out_dir, 600, n_users=20, n_factors=8, seed=0)
+    return out_dir
+
+
+@pytest.fixture(scope='session')
+def app_module(catalog_dir):
+    """The app, loaded once per session from the synthetic catalog."""
+    os.environ['DATA_DIR'] = os.path.join(catalog_dir, 'data')
+    os.environ['MODELS_DIR'] = os.path.join(catalog_dir, 'models')
+    os.environ.pop('INGEST_TOKEN', None)
+    return importlib.import_module('app')
+
+
+@pytest.fixture
+def client(app_module):
+    app_module.response_cache.clear()
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def build_dir(catalog_dir, tmp_path):
+    """A copy of the synthetic catalog that build steps may overwrite."""
+    shutil.copytree(catalog_dir, tmp_path, dirs_exist_ok=True)
+    return str(tmp_path)
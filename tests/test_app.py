@@ -0,0 +1,114 @@
+"""Recommendation, batch and search endpoints on the synthetic test catalog."""
+import numpy as np
+import pytest
+from flask import g
+
+from catalog import filter_mask
+
+
+def movie_ids(app_module, rows):
+    return app_module.models['catalog']['movie_id'][rows].tolist()
+
+
+def test_batch_falls_back_per_entry(app_module, client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('scoring failed')
+
+    monkeypatch.setattr(app_module, 'get_seeded_recommendations', fail)
+    seeded = {'seedMovieIds': movie_ids(app_module, [3, 7]), 'rating': 'high-rated'}
+    mood = {'recommendationType': 'mood', 'subType': 'happy'}
+
+    response = client.post('/api/recommendations/batch', json=[seeded, mood])
+
+    assert response.status_code == 200
+    basic = client.post('/api/recommendations', json={'rating': 'high-rated'}).get_json()
+    assert response.get_json() == [basic, client.post('/api/recommendations', json=mood).get_json()]
+
+
+@pytest.mark.parametrize('aggregation', ['mean', 'max'])
+def test_seeded_recommendations_rank_by_similarity(app_module, aggregation):
+    models = app_module.models
+    catalog, vectors = models['catalog'], models['tfidf_matrix']
+    seed_rows = np.array([3, 7, 11])
+    mask = filter_mask(catalog, time_period='modern')
+
+    with app_module.app.app_context():
+        g.models = models
+        [(rows, scores)] = app_module.score_seeded_rows([seed_rows], [mask], aggregation, k=6)
+
+    seed_scores = (vectors @ vectors[seed_rows].T).toarray()
+    exact = seed_scores.mean(axis=1) if aggregation == 'mean' else seed_scores.max(axis=1)
+    allowed = mask.copy()
+    allowed[seed_rows] = False
+    assert len(rows) == 6 and allowed[rows].all()
+    np.testing.assert_allclose(scores, np.sort(exact[allowed])[::-1][:6], rtol=0, atol=1e-5)
+    np.testing.assert_allclose(exact[rows], scores, rtol=0, atol=1e-5)
+
+
+def test_seeded_request_limits_seeds(app_module, client):
+    seeds = list(range(1, app_module.MAX_SEEDS + 2))
+
+    response = client.post('/api/recommendations', json={'seedMovieIds': seeds})
+
+    assert response.status_code == 400
+    assert str(app_module.MAX_SEEDS) in response.get_json()['error']
+
+
+def test_search_matches_exact_ranking(app_module, client):
+    models = app_module.models
+    catalog = models['catalog']
+    text = 'a dangerous journey home to the old world'
+    query = models['tfidf'].transform([text])
+    exact = (models['tfidf_matrix'] @ query.T).toarray().ravel()
+    mask = filter_mask(catalog, rating='high-rated') & (exact > 0)
+
+    rows, scores = models['search_index'].search(query, k=10, accept=lambda rows: mask[rows])
+
+    assert len(rows) == 10 and mask[rows].all()
+    np.testing.assert_allclose(scores, np.sort(exact[mask])[::-1][:10], rtol=0, atol=1e-5)
+    response = client.post('/api/search', json={'query': text, 'limit': 10, 'rating': 'high-rated'})
+    assert [movie['title'] for movie in response.get_json()] == catalog['display_title'].take(rows).tolist()
+
+
+def test_cache_key_normalizes_preferences(app_module):
+    def key(**payload):
+        return app_module.cache_key(app_module.parse_preferences(payload))
+
+    assert key(genre=['Drama', 'Comedy', 'Drama']) == key(genre=['Comedy', 'Drama'])
+    assert key(genre='any') == key()
+    assert key(seedMovieIds=[5, 2, 5]) == key(seedMovieIds=[2, 5])
+    assert key(seedMovieIds=[2, 5]) != key(seedMovieIds=[2, 5], seedAggregation='max')
+    assert key(recommendationType='personalized', userId=1) != key(recommendationType='personalized', userId=2)
+    assert key(recommendationType='mood', subType='happy') != \
+        key(recommendationType='mood', subType='happy', rating='high-rated')
+    assert key(recommendationType='content') is None
+
+
+def test_cached_bodies_are_keyed_by_generation(app_module, client, monkeypatch):
+    payload = {'recommendationType': 'discovery', 'subType': 'hidden'}
+    fresh = client.post('/api/recommendations', json=payload).get_data()
+    key = (app_module.models.get('generation', 0),) + app_module.cache_key(app_module.parse_preferences(payload))
+    assert app_module.response_cache.get(key) == fresh
+
+    app_module.response_cache.put(key, b'[]')
+    assert client.post('/api/recommendations', json=payload).get_data() == b'[]'
+    # A new snapshot (after an ingest) never serves bodies computed from the old one
+    monkeypatch.setattr(app_module, 'models', dict(app_module.models, generation=key[0] + 1))
+    assert client.post('/api/recommendations', json=payload).get_data() == fresh
+
+
+def test_fallback_responses_are_not_cached(app_module, client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('selection failed')
+
+    payload = {'recommendationType': 'regional', 'subType': 'Bollywood'}
+    key = (app_module.models.get('generation', 0),) + app_module.cache_key(app_module.parse_preferences(payload))
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module, 'get_regional_selection', fail)
+        fallback = client.post('/api/recommendations', json=payload).get_json()
+    assert fallback == client.post('/api/recommendations', json={}).get_json()
+    assert app_module.response_cache.get(key) is None
+
+    regional = client.post('/api/recommendations', json=payload).get_json()
+    assert regional != fallback and {movie['region'] for movie in regional} == {'Bollywood'}
+    assert app_module.response_cache.get(key) is not None
@@ -0,0 +1,45 @@
+"""The ASGI entry point against the Flask routes, driven in process."""
+import asyncio
+
+import pytest
+
+from benchmark import asgi_post
+
+
+@pytest.fixture
+def asgi_module(app_module):
+    import asgi
+
+    app_module.response_cache.clear()
+    return asgi
+
+
+def post(asgi_module, path, payload):
+    server = asgi_module.RecommendationServer(threads=2)
+    try:
+        return asyncio.run(asgi_post(server, path, payload))
+    finally:
+        server.executor.shutdown()
+
+
+def test_recommendations_match_flask_and_record_parse_stage(app_module, asgi_module, client):
+    payload = {'recommendationType': 'mood', 'subType': 'happy', 'genre': ['Drama']}
+    parse_calls = app_module.STAGES['parse'].summary()[0]
+
+    status, _, body = post(asgi_module, '/api/recommendations', payload)
+
+    assert status == 200
+    assert app_module.STAGES['parse'].summary()[0] == parse_calls + 1
+    assert body == client.post('/api/recommendations', json=payload).get_data()
+
+
+@pytest.mark.parametrize('path', ['/api/recommendations', '/api/search'])
+def test_oversized_bodies_are_refused(asgi_module, monkeypatch, path):
+    monkeypatch.setattr(asgi_module, 'MAX_BODY_SIZE', 64)
+
+    status, _, body = post(asgi_module, path, {'query': 'heist ' * 20, 'recommendationType': 'mood'})
+
+    assert status == 413
+    assert b'64 bytes' in body
+    status, _, _ = post(asgi_module, path, {'query': 'heist'})
+    assert status != 413
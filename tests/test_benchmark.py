@@ -0,0 +1,33 @@
+"""Smoke tests of `python benchmark.py run` on a small synthetic catalog."""
+import pytest
+
+from benchmark import run_benchmark
+
+
+def test_run_benchmark_covers_every_path(app_module, catalog_dir):
+    report = run_benchmark(catalog_dir, n_requests=3, warmup=1, memory_requests=1)
+
+    paths = {result['path'] for result in report['results']}
+    assert {'content', 'basic', 'personalized'} <= paths
+    assert report['catalog']['users'] == 20
+    assert all(result['requests'] == 3 for result in report['results'])
+
+
+def test_run_benchmark_without_mappable_factors(app_module, catalog_dir, monkeypatch):
+    # What prepare_factors leaves when the factor rows cannot be tied to the catalog
+    models = {key: value for key, value in app_module.models.items()
+              if key not in ('factor_rows', 'catalog_factor_rows')}
+    monkeypatch.setattr(app_module, 'models', models)
+
+    report = run_benchmark(catalog_dir, n_requests=3, warmup=1, memory_requests=1)
+
+    assert report['catalog']['users'] == 0
+    assert 'personalized' not in {result['path'] for result in report['results']}
+
+
+@pytest.mark.parametrize('interfaces', [('http',), ('direct',)])
+def test_run_benchmark_single_interface(app_module, catalog_dir, interfaces):
+    report = run_benchmark(catalog_dir, n_requests=2, warmup=0, memory_requests=1, interfaces=interfaces,
+                           path_filter=['basic'])
+
+    assert [(result['path'], result['interface']) for result in report['results']] == [('basic', interfaces[0])]
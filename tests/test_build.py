@@ -0,0 +1,44 @@
+"""Offline build steps on a copy of the synthetic test catalog."""
+import argparse
+import os
+
+import numpy as np
+import pytest
+
+from build import NEIGHBOR_IDS_FILE, NEIGHBOR_SCORES_FILE, cmd_bundle, cmd_neighbors, cmd_tfidf
+from bundle import check_bundle_tfidf
+
+
+def build_args(build_dir, **kwargs):
+    return argparse.Namespace(models_dir=os.path.join(build_dir, 'models'), data_dir=os.path.join(build_dir, 'data'),
+                              **kwargs)
+
+
+def tfidf_args(build_dir, max_features=500):
+    return build_args(build_dir, workers=1, chunk_size=200, max_features=max_features)
+
+
+def test_neighbors_are_swapped_in_whole(build_dir):
+    args = build_args(build_dir, k=5, block_size=None)
+    cmd_neighbors(args)
+
+    assert sorted(name for name in os.listdir(args.models_dir) if name.startswith('neighbor_')) == \
+        [NEIGHBOR_IDS_FILE, NEIGHBOR_SCORES_FILE]
+    ids = np.load(os.path.join(args.models_dir, NEIGHBOR_IDS_FILE))
+    assert ids.shape == (600, 5)
+
+
+def test_tfidf_rebuild_invalidates_bundle_and_neighbors(build_dir):
+    cmd_tfidf(tfidf_args(build_dir))
+    cmd_neighbors(build_args(build_dir, k=5, block_size=None))
+    cmd_bundle(build_args(build_dir))
+    models_dir = os.path.join(build_dir, 'models')
+    check_bundle_tfidf(models_dir)
+
+    cmd_tfidf(tfidf_args(build_dir, max_features=300))
+
+    assert not os.path.exists(os.path.join(models_dir, NEIGHBOR_IDS_FILE))
+    with pytest.raises(ValueError, match='rebuild it'):
+        check_bundle_tfidf(models_dir)
+    cmd_bundle(build_args(build_dir))
+    check_bundle_tfidf(models_dir)
@@ -0,0 +1,72 @@
+"""Model bundle and TF-IDF manifest checks on a copy of the synthetic test catalog."""
+import argparse
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import g
+from scipy.sparse import load_npz
+
+from build import cmd_bundle, cmd_tfidf
+from tfidf import check_tfidf, read_manifest
+
+
+def build_args(build_dir, **kwargs):
+    return argparse.Namespace(models_dir=os.path.join(build_dir, 'models'), data_dir=os.path.join(build_dir, 'data'),
+                              **kwargs)
+
+
+def test_bundle_round_trip_matches_csv_load(app_module, build_dir):
+    cmd_bundle(build_args(build_dir))
+    bundled = app_module.load_bundle_models(os.path.join(build_dir, 'models'))
+    loaded = app_module.models
+    rows = np.arange(loaded['catalog']['size'])
+
+    def served(models):
+        with app_module.app.app_context():
+            g.models = models
+            return app_module.format_recommendations(rows), app_module.get_basic_recommendations(
+                np.ones(len(rows), dtype=bool), num_recommendations=20)
+
+    assert served(bundled) == served(loaded)
+    assert bundled['catalog']['orders'].keys() == loaded['catalog']['orders'].keys()
+    for name, order in loaded['catalog']['orders'].items():
+        np.testing.assert_array_equal(bundled['catalog']['orders'][name], order, err_msg=name)
+    assert (bundled['tfidf_matrix'] != loaded['tfidf_matrix']).nnz == 0
+    for name, array in loaded['search_index'].arrays().items():
+        np.testing.assert_array_equal(bundled['search_index'].arrays()[name], array, err_msg=name)
+    np.testing.assert_array_equal(bundled['catalog_factor_rows'], loaded['catalog_factor_rows'])
+    text = ['survival in the old world']
+    assert (bundled['tfidf'].transform(text) != loaded['tfidf'].transform(text)).nnz == 0
+
+
+def test_tfidf_manifest_rejects_other_artifacts(app_module, build_dir):
+    args = build_args(build_dir, workers=1, chunk_size=200, max_features=500)
+    cmd_tfidf(args)
+    manifest = read_manifest(args.models_dir)
+    movies_df = pd.read_csv(os.path.join(args.data_dir, 'movies2024.csv'))
+    matrix_path = os.path.join(args.models_dir, 'tfidf_matrix.npz')
+    vectorizer_path = os.path.join(args.models_dir, 'tfidf_vectorizer.pkl')
+
+    models = {'tfidf': object()}
+    assert app_module.load_tfidf_matrix(args.models_dir, matrix_path, movies_df, models).shape == \
+        (len(movies_df), manifest['vocabulary_size'])
+
+    # A catalog in another order, or one movie short, is not the one the matrix was built for
+    for other_df in (movies_df.iloc[::-1], movies_df.iloc[:-1]):
+        models = {'tfidf': object()}
+        assert app_module.load_tfidf_matrix(args.models_dir, matrix_path, other_df, models) is None
+        assert 'tfidf' not in models
+
+    with open(vectorizer_path, 'rb') as f:
+        vectorizer = pickle.load(f)
+    vectorizer.set_params(max_features=400)
+    with open(vectorizer_path, 'wb') as f:
+        pickle.dump(vectorizer, f)
+    matrix = load_npz(matrix_path)
+    with pytest.raises(ValueError, match='vectorizer'):
+        check_tfidf(manifest, matrix, movies_df['MovieID'].to_numpy(dtype=np.int64), vectorizer_path)
+    with pytest.raises(ValueError, match='does not match its manifest'):
+        check_tfidf(manifest, matrix[:, :-1], movies_df['MovieID'].to_numpy(dtype=np.int64))
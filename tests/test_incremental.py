@@ -0,0 +1,111 @@
+"""
+Incremental updates used by ingestion against a full rebuild, on small
+synthetic catalogs with deliberate ties (duplicate rows and repeated values).
+"""
+import numpy as np
+import pytest
+from scipy import sparse
+
+from build import build_neighbor_table
+from catalog import build_orderings, merge_orderings, ranking_scores
+from ingest import extend_neighbor_table
+from search import InvertedIndex
+from similarity import normalize_rows
+
+
+def synthetic_vectors(n_rows=80, n_terms=40, seed=0):
+    """L2-normalized float32 TF-IDF-like rows; every fifth row repeats an earlier one."""
+    rng = np.random.default_rng(seed)
+    matrix = sparse.random(n_rows, n_terms, density=0.15, format='csr', dtype=np.float32, random_state=rng)
+    matrix = sparse.vstack([matrix[i - 3] if i % 5 == 4 else matrix[i] for i in range(n_rows)], format='csr')
+    return normalize_rows(matrix, dtype=np.float32)
+
+
+def exact_scores(vectors, ids):
+    """Exact similarity of every row to each of its listed neighbors."""
+    dense = vectors.toarray().astype(np.float64)
+    return np.take_along_axis(dense @ dense.T, ids, axis=1)
+
+
+@pytest.mark.parametrize('n_old', [1, 40, 79])
+def test_extend_neighbor_table_matches_rebuild(n_old):
+    vectors = synthetic_vectors()
+    k = 6
+    ids, scores = build_neighbor_table(vectors[:n_old], k=k)
+    # A catalog of one movie has no neighbors; the table still has K columns
+    ids = np.pad(ids, ((0, 0), (0, k - ids.shape[1])), constant_values=-1)
+    scores = np.pad(scores, ((0, 0), (0, k - scores.shape[1])))
+
+    extended_ids, extended_scores = extend_neighbor_table(ids, scores, vectors, n_old)
+    rebuilt_ids, rebuilt_scores = build_neighbor_table(vectors, k=k)
+
+    assert extended_ids.shape == rebuilt_ids.shape
+    assert extended_ids.dtype == rebuilt_ids.dtype and extended_scores.dtype == rebuilt_scores.dtype
+    rows = np.arange(vectors.shape[0])[:, None]
+    assert (extended_ids >= 0).all() and (extended_ids != rows).all()
+    assert all(len(set(row)) == k for row in extended_ids.tolist())
+    # Tied neighbors may be listed in either order (or swapped for one another), so the
+    # exact similarities of the listed neighbors are compared rather than their ids
+    np.testing.assert_allclose(exact_scores(vectors, extended_ids), exact_scores(vectors, rebuilt_ids),
+                               rtol=0, atol=1e-6)
+    np.testing.assert_allclose(extended_scores.astype(np.float32), rebuilt_scores.astype(np.float32),
+                               rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize('n_old', [0, 1, 40, 80])
+def test_inverted_index_append_matches_rebuild(n_old):
+    vectors = synthetic_vectors()
+    appended = InvertedIndex.from_matrix(vectors[:n_old]).append(vectors[n_old:], n_old)
+    rebuilt = InvertedIndex.from_matrix(vectors)
+
+    for name, array in rebuilt.arrays().items():
+        np.testing.assert_array_equal(appended.arrays()[name], array, err_msg=name)
+        assert appended.arrays()[name].dtype == array.dtype
+
+
+def synthetic_catalog(n_rows=300, seed=0):
+    """Rating, popularity and year columns drawn from a few values each, with some missing."""
+    rng = np.random.default_rng(seed)
+    rating = rng.choice([5.5, 6.3, 7.1, 7.1, 8.0], size=n_rows).astype(np.float32)
+    popularity = rng.choice([1.0, 12.5, 30.0, 99.0], size=n_rows).astype(np.float32)
+    year = rng.choice([1970, 1999, 2020], size=n_rows).astype(np.float32)
+    rating[rng.random(n_rows) < 0.05] = np.nan
+    popularity[rng.random(n_rows) < 0.05] = np.nan
+    return {'rating': rating, 'popularity': popularity, 'year': year}
+
+
+@pytest.mark.parametrize('n_old', [1, 150, 299])
+def test_merge_orderings_matches_rebuild(n_old):
+    columns = synthetic_catalog()
+    old_catalog = {key: column[:n_old] for key, column in columns.items()}
+    build_orderings(old_catalog, ranking_scores(old_catalog))
+    rebuilt_catalog = dict(columns)
+    build_orderings(rebuilt_catalog, ranking_scores(rebuilt_catalog))
+
+    merged = merge_orderings(old_catalog['orders'], ranking_scores(columns), n_old)
+
+    assert merged.keys() == rebuilt_catalog['orders'].keys()
+    # Ties are broken by catalog row in both, so the orders match exactly
+    for name, order in rebuilt_catalog['orders'].items():
+        np.testing.assert_array_equal(merged[name], order, err_msg=name)
+        assert merged[name].dtype == order.dtype
+
+
+def test_ingested_movies_without_region_are_classified(app_module):
+    from catalog import REGIONS, lookup_rows
+    from ingest import append_movies, movies_frame
+
+    models = app_module.models
+    next_id = int(np.max(models['catalog']['movie_id'])) + 1
+    movies_df = movies_frame([
+        {'MovieID': next_id, 'Title': 'Harbour Lights', 'Overview': 'A Telugu family drama', 'Region': None},
+        {'MovieID': next_id + 1, 'Title': 'Harbour Lights', 'Overview': 'A Telugu family drama',
+         'Region': 'Kollywood'},
+        {'MovieID': next_id + 2, 'Title': 'Quiet Plains', 'Overview': 'A ranch in winter'},
+    ])
+    snapshot, added_ids, _ = append_movies(models, movies_df)
+
+    catalog = snapshot['catalog']
+    regions = catalog['region'][lookup_rows(catalog, np.array(added_ids))]
+    assert [REGIONS[code] for code in regions] == ['Tollywood', 'Kollywood', 'Hollywood']
+    assert models['catalog']['size'] == snapshot['catalog']['size'] - 3
@@ -0,0 +1,253 @@
+"""
+Offline TF-IDF build for the content recommendations (`python build.py tfidf`).
+
+The movie CSV is streamed in chunks and each chunk's documents
+(`catalog.content_text`, the text ingestion transforms too) are tokenized
+on a process pool, in two passes:
+
+1. Every chunk reports its term and document counts; the counts are summed
+   and the vocabulary is chosen from the totals (min_df, max_df and
+   max_features applied to the whole catalog, as a single fit would).
+2. Every chunk is transformed with the fixed vocabulary and idf weights into
+   float32, L2-normalized rows, so cosine similarity is a plain dot product.
+
+Only a few chunks are in flight at a time, besides the matrix being
+assembled. The vectorizer, the matrix and `tfidf_manifest.json` are written
+to temporary files and renamed into place, the manifest last; it records
+the catalog and the artifacts it describes, and load_models checks it
+before serving them. Artifacts derived from the previous matrix (the
+neighbor table) are deleted just before the swap, so they are never served
+against the new one.
+"""
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from catalog import CONTENT_TEXT_COLUMNS, content_text
+
+VECTORIZER_FILE = 'tfidf_vectorizer.pkl'
+MATRIX_FILE = 'tfidf_matrix.npz'
+MANIFEST_FILE = 'tfidf_manifest.json'
+FORMAT_VERSION = 1
+
+# Vectorizer settings of the original artifacts
+DEFAULT_PARAMS = {'stop_words': 'english', 'max_features': 2000}
+
+# Settings that decide how text is split into terms (the rest select and weight the vocabulary)
+COUNT_PARAMS = ('input', 'encoding', 'decode_error', 'strip_accents', 'lowercase', 'preprocessor', 'tokenizer',
+                'stop_words', 'token_pattern', 'ngram_range', 'analyzer', 'binary')
+
+_tfidf_job = {}
+
+
+def _init_tfidf_job(vectorizer):
+    # Each worker receives the vectorizer (settings only in pass 1) once
+    _tfidf_job['vectorizer'] = vectorizer
+
+
+def _count_terms(chunk):
+    """(MovieIDs, terms, document frequencies, term frequencies) of one chunk."""
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    params = _tfidf_job['vectorizer'].get_params()
+    counter = CountVectorizer(**{key: params[key] for key in COUNT_PARAMS})
+    movie_ids = chunk['MovieID'].to_numpy(dtype=np.int64)
+    try:
+        counts = counter.fit_transform(content_text(chunk))
+    except ValueError:
+        # Not a single term in the chunk survives the stop words
+        return movie_ids, [], [], []
+    term_counts = np.asarray(counts.sum(axis=0)).ravel()
+    counts.data[:] = 1
+    doc_counts = np.asarray(counts.sum(axis=0)).ravel()
+    return movie_ids, counter.get_feature_names_out().tolist(), doc_counts.tolist(), term_counts.tolist()
+
+
+def _transform_chunk(chunk):
+    return _tfidf_job['vectorizer'].transform(content_text(chunk))
+
+
+def map_chunks(function, chunks, vectorizer, workers=1):
+    """
+    Yield function(chunk) for every chunk, in order, on `workers` processes.
+    At most two chunks per worker are submitted ahead of the results, so the
+    CSV is never read far ahead of the tokenizers.
+    """
+    if workers <= 1:
+        _init_tfidf_job(vectorizer)
+        try:
+            for chunk in chunks:
+                yield function(chunk)
+        finally:
+            _tfidf_job.clear()
+        return
+    with multiprocessing.Pool(workers, initializer=_init_tfidf_job, initargs=(vectorizer,)) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def read_chunks(movies_path, chunk_size):
+    """The MovieID and document columns of the movie CSV, `chunk_size` rows at a time."""
+    return pd.read_csv(movies_path, chunksize=chunk_size,
+                       usecols=lambda name: name == 'MovieID' or name in CONTENT_TEXT_COLUMNS)
+
+
+def select_vocabulary(doc_counts, term_counts, n_docs, min_df=1, max_df=1.0, max_features=None):
+    """
+    Sorted vocabulary from catalog-wide counts (dicts term -> count), with
+    TfidfVectorizer's rules: min_df/max_df bound the document frequency
+    (a fraction of n_docs when a float), then the max_features terms with
+    the highest term frequency are kept (ties broken alphabetically).
+    """
+    min_count = min_df if isinstance(min_df, int) else min_df * n_docs
+    max_count = max_df if isinstance(max_df, int) else max_df * n_docs
+    terms = [term for term, count in doc_counts.items() if min_count <= count <= max_count]
+    if max_features is not None and len(terms) > max_features:
+        terms = sorted(terms, key=lambda term: (-term_counts[term], term))[:max_features]
+    return sorted(terms)
+
+
+def idf_weights(doc_counts, n_docs, smooth_idf=True):
+    """Inverse document frequencies, as TfidfTransformer computes them."""
+    doc_counts = np.asarray(doc_counts, dtype=np.float64)
+    if smooth_idf:
+        return np.log((1 + n_docs) / (1 + doc_counts)) + 1
+    return np.log(n_docs / doc_counts) + 1
+
+
+def build_tfidf(movies_path, models_dir, params=None, workers=1, chunk_size=20000, stale_files=()):
+    """
+    Fit the TF-IDF vectorizer and matrix on the movie CSV and swap them in.
+
+    `params` are TfidfVectorizer settings (DEFAULT_PARAMS by default); rows
+    are always L2-normalized float32. `stale_files` are paths derived from the
+    old matrix, deleted before the swap. Returns the written manifest, with
+    the seconds each pass took under 'timings' and the deleted paths under
+    'removed'.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(**dict(DEFAULT_PARAMS if params is None else params,
+                                        norm='l2', dtype=np.float32))
+
+    # Pass 1: catalog-wide term and document counts
+    started = time.perf_counter()
+    doc_counts, term_counts = collections.Counter(), collections.Counter()
+    movie_ids = []
+    for chunk_ids, terms, chunk_doc_counts, chunk_term_counts in map_chunks(
+            _count_terms, read_chunks(movies_path, chunk_size), vectorizer, workers):
+        movie_ids.append(chunk_ids)
+        doc_counts.update(dict(zip(terms, chunk_doc_counts)))
+        term_counts.update(dict(zip(terms, chunk_term_counts)))
+    movie_ids = np.concatenate(movie_ids) if movie_ids else np.empty(0, dtype=np.int64)
+    n_docs = len(movie_ids)
+    vocabulary = select_vocabulary(doc_counts, term_counts, n_docs, vectorizer.min_df, vectorizer.max_df,
+                                   vectorizer.max_features)
+    if not vocabulary:
+        raise ValueError('The movie data has no terms to index')
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(vocabulary)}
+    if vectorizer.use_idf:
+        vectorizer.idf_ = idf_weights([doc_counts[term] for term in vocabulary], n_docs, vectorizer.smooth_idf)
+    count_seconds = time.perf_counter() - started
+
+    # Pass 2: transform every chunk with the fixed vocabulary
+    started = time.perf_counter()
+    parts = list(map_chunks(_transform_chunk, read_chunks(movies_path, chunk_size), vectorizer, workers))
+    matrix = sparse.vstack(parts, format='csr', dtype=np.float32)
+    if matrix.shape[0] != n_docs:
+        raise ValueError(f"{movies_path} changed during the build ({n_docs} then {matrix.shape[0]} rows)")
+    transform_seconds = time.perf_counter() - started
+
+    manifest = write_tfidf(models_dir, vectorizer, matrix, movie_ids, source=os.path.basename(movies_path),
+                           stale_files=stale_files)
+    manifest['timings'] = {'count_seconds': count_seconds, 'transform_seconds': transform_seconds}
+    return manifest
+
+
+def write_tfidf(models_dir, vectorizer, matrix, movie_ids, source=None, stale_files=()):
+    """
+    Write the vectorizer, matrix and manifest, each renamed into place once
+    complete (manifest last), after deleting whichever `stale_files` exist.
+    """
+    paths = {name: os.path.join(models_dir, name) for name in (VECTORIZER_FILE, MATRIX_FILE, MANIFEST_FILE)}
+    with open(paths[VECTORIZER_FILE] + '.tmp', 'wb') as f:
+        pickle.dump(vectorizer, f)
+    with open(paths[MATRIX_FILE] + '.tmp', 'wb') as f:
+        sparse.save_npz(f, matrix)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'source': source,
+        'documents': list(CONTENT_TEXT_COLUMNS),
+        'movies': int(matrix.shape[0]),
+        'movie_ids_sha256': ids_digest(movie_ids),
+        'vocabulary_size': int(matrix.shape[1]),
+        'nnz': int(matrix.nnz),
+        'norm': 'l2',
+        'vectorizer_sha256': file_digest(paths[VECTORIZER_FILE] + '.tmp'),
+        'params': {key: value for key, value in vectorizer.get_params().items()
+                   if isinstance(value, (str, int, float, bool, type(None), list, tuple))},
+    }
+    with open(paths[MANIFEST_FILE] + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    removed = [path for path in stale_files if os.path.isfile(path)]
+    for path in removed:
+        os.remove(path)
+    for name in (VECTORIZER_FILE, MATRIX_FILE, MANIFEST_FILE):
+        os.replace(paths[name] + '.tmp', paths[name])
+    manifest['removed'] = removed
+    return manifest
+
+
+def ids_digest(movie_ids):
+    return hashlib.sha256(np.ascontiguousarray(movie_ids, dtype='<i8').tobytes()).hexdigest()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(models_dir):
+    """The manifest of `python build.py tfidf`, or None for artifacts built elsewhere."""
+    path = os.path.join(models_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def check_tfidf(manifest, matrix, movie_ids, vectorizer_path=None):
+    """
+    Raise ValueError unless the loaded TF-IDF matrix (and vectorizer file)
+    are the ones the manifest describes, built for these MovieIDs in order.
+    """
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported TF-IDF manifest format {manifest.get('format_version')} "
+                         f"(expected {FORMAT_VERSION})")
+    if list(matrix.shape) != [manifest['movies'], manifest['vocabulary_size']] or matrix.nnz != manifest['nnz']:
+        raise ValueError(f"The TF-IDF matrix {matrix.shape} does not match its manifest "
+                         f"({manifest['movies']} x {manifest['vocabulary_size']}, {manifest['nnz']} entries)")
+    if len(movie_ids) != manifest['movies'] or ids_digest(movie_ids) != manifest['movie_ids_sha256']:
+        raise ValueError(f"The TF-IDF artifacts were built for a different movie catalog "
+                         f"({manifest['movies']} movies from {manifest.get('source')})")
+    if vectorizer_path is not None and file_digest(vectorizer_path) != manifest['vectorizer_sha256']:
+        raise ValueError('The TF-IDF vectorizer does not match its manifest')